@@ -3,44 +3,213 @@ import pandas as pd
 import numpy as np
 import altair as alt
 import inspect
+import time
+import tracemalloc
 from io import BytesIO
 
+# Column order of the tall frame built by perform_calculations()
+TALL_COLUMNS = ['value', 'close', 'pnl', 'logret', 'cumret']
+
+def _panel_block(shares, prices, prev_value=None, base_value=None, cum_logret=None):
+    """
+    Compute every tall column in one pass over a (dates x tickers) price array.
+
+    Returns a contiguous float64 array of shape (5, tickers + 1, dates), one
+    slab per entry of TALL_COLUMNS, with the aggregate portfolio as the last
+    ticker. Each slab is laid out ticker-major so it can back the tall frame
+    without any further reshuffling.
+
+    When the rows continue an existing panel, pass the state of the last
+    stored row: prev_value (values on the previous date), base_value (values
+    on the first date, for PNL) and cum_logret (running sum of log returns).
+    All three are arrays of length tickers + 1.
+    """
+    n_dates, n_tickers = prices.shape
+    block = np.empty((len(TALL_COLUMNS), n_tickers + 1, n_dates))
+
+    # Transposed views give (dates x tickers) windows onto each slab
+    value, close, pnl, logret, cumret = (slab.T for slab in block)
+
+    # Position values and the aggregate portfolio value
+    np.multiply(prices, shares, out=value[:, :n_tickers])
+    value[:, n_tickers] = np.nansum(value[:, :n_tickers], axis=1)
+
+    close[:, :n_tickers] = prices
+    close[:, n_tickers] = np.nan
+
+    # PNL relative to the first date
+    np.subtract(value, value[0] if base_value is None else base_value, out=pnl)
+
+    # Log returns (zero or negative values give -inf / NaN, as in pandas)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logret[0] = np.nan if prev_value is None else np.log(value[0] / prev_value)
+        np.divide(value[1:], value[:-1], out=logret[1:])
+        np.log(logret[1:], out=logret[1:])
+
+    # Cumulative returns: missing log returns stay missing but do not reset the sum
+    missing = np.isnan(logret)
+    running = np.nancumsum(logret, axis=0)
+    if cum_logret is not None:
+        running += cum_logret
+    np.exp(running, out=cumret)
+    cumret -= 1
+    cumret[missing] = np.nan
+    if prev_value is None:
+        cumret[0] = 0
+
+    return block
+
 def perform_calculations(ptf, df_hist):
     """
     Perform calculations using portfolio and historical data
-    Returns a tuple of (portfolio history, log returns)
+    Returns the tall DataFrame indexed by (Ticker, Date) with the columns
+    value, close, pnl, logret and cumret
+    """
+
+    # Line up the share counts with the price columns (union of both ticker lists)
+    shares = ptf.set_index('Ticker')['Shares']
+    prices, shares = df_hist.align(shares, join='outer', axis=1)
+
+    # Compute all columns on one contiguous (dates x tickers) array
+    block = _panel_block(shares.to_numpy(dtype=float), prices.to_numpy(dtype=float))
+
+    # Wrap the block as the tall frame, ticker-major like an unstacked panel
+    tickers = prices.columns.append(pd.Index(['Portfolio']))
+    index = pd.MultiIndex.from_product([tickers, prices.index], names=['Ticker', 'Date'])
+    tall = pd.DataFrame(block.reshape(len(TALL_COLUMNS), -1).T, index=index, columns=TALL_COLUMNS)
+
+    return tall
+
+def append_calculations(tall, ptf, df_hist):
+    """
+    Bring an existing tall frame up to date with new rows of df_hist.
+
+    Only the dates from the last stored date onwards are computed (the last
+    date is recomputed so intraday refreshes pick up revised prices), with
+    pnl, logret and cumret continuing from the state stored in tall. The
+    stored history is never recomputed: apart from a single copy of the
+    stored block into the enlarged frame, the cost grows with the number of
+    new rows rather than with the length of the history.
+
+    Falls back to perform_calculations() when tall no longer lines up with
+    ptf and df_hist: different tickers or share counts, a different start
+    date, or prices that were re-adjusted after tall was built.
     """
+    # tall is ticker-major and rectangular, so tickers and dates can be read off the codes
+    n_tickers = len(tall.index.levels[0])
+    n_dates = len(tall) // n_tickers if n_tickers else 0
+    if n_dates < 2 or n_tickers * n_dates != len(tall) or len(df_hist) == 0:
+        return perform_calculations(ptf, df_hist)
+    stored_tickers = tall.index.levels[0].take(tall.index.codes[0][::n_dates])
+    dates = tall.index.levels[1].take(tall.index.codes[1][:n_dates])
+    if df_hist.index[0] != dates[0] or dates[-2] not in df_hist.index or dates[-1] not in df_hist.index:
+        return perform_calculations(ptf, df_hist)
 
-    # Calculate historical value of each asset in the portfolio
+    # Only the last kept row and the rows from the last stored date onwards are needed
+    shares = ptf.set_index('Ticker')['Shares']
+    recent = df_hist.iloc[df_hist.index.get_loc(dates[-2]):]
+    recent, shares = recent.align(shares, join='outer', axis=1)
+    tickers = recent.columns.append(pd.Index(['Portfolio']))
+    if not stored_tickers.equals(tickers):
+        return perform_calculations(ptf, df_hist)
+
+    # (tickers x dates) views onto the stored columns
+    if list(tall.columns) != TALL_COLUMNS:
+        tall = tall[TALL_COLUMNS]
+    stored = tall.to_numpy().T.reshape(len(TALL_COLUMNS), n_tickers, n_dates)
+    value, cumret = stored[0], stored[4]
+    shares = shares.to_numpy(dtype=float)
+    recent_prices = recent.to_numpy(dtype=float)
+
+    # Spot-check the last row we keep: share changes or re-adjusted prices force a rebuild
+    if not np.allclose(recent_prices[0] * shares, value[:-1, -2], equal_nan=True):
+        return perform_calculations(ptf, df_hist)
+
+    # Nothing new and no revised prices: keep the stored frame
+    if len(recent) == 2 and np.array_equal(recent_prices[1], stored[1][:-1, -1], equal_nan=True):
+        return tall
+
+    # State carried over from the last row we keep
+    prev_value = value[:, -2]
+    base_value = value[:, 0]
+    cum_logret = np.log1p(cumret[:, -2])
+    stale = np.isnan(cum_logret)
+    if stale.any():
+        # Tickers with a missing return on that day continue from their last valid cumret
+        last_valid = pd.DataFrame(cumret[stale, :-1].T).ffill().iloc[-1].to_numpy()
+        cum_logret[stale] = np.log1p(last_valid)
+
+    new_block = _panel_block(shares, recent_prices[1:], prev_value, base_value, cum_logret)
+
+    block = np.concatenate([stored[:, :, :-1], new_block], axis=2)
+    all_dates = dates[:-1].append(pd.Index(recent.index[1:]))
+    index = pd.MultiIndex.from_product([tickers, all_dates], names=['Ticker', 'Date'])
+    return pd.DataFrame(block.reshape(len(TALL_COLUMNS), -1).T, index=index, columns=TALL_COLUMNS)
+
+def _perform_calculations_unstacked(ptf, df_hist):
+    """
+    Original pandas implementation of perform_calculations(), kept as the
+    reference for parity checks and benchmarks
+    """
     ptf_hist = ptf.set_index('Ticker')['Shares'] * df_hist
-    
-    # Calculate the historical value of the portfolio
     ptf_hist['Portfolio'] = ptf_hist.sum(axis=1)
-
-    # Calculate the PNL history for each stock including the aggregate portfolio
     ptf_pnl = ptf_hist - ptf_hist.iloc[0]
-
-    # Calculate the log returns of the portfolio from the historical values
     logret = np.log(ptf_hist / ptf_hist.shift(1))
-
-    # Calculate the cumulative returns of the portfolio from the log returns
     cumret = np.exp(logret.cumsum()) - 1
     cumret.iloc[0] = 0
 
-    # Create a new DataFrame 'tall' and add each unstacked DataFrame as a column
     tall = pd.DataFrame()
-    
     tall['value'] = ptf_hist.unstack().to_frame(name='value')['value']
     tall['close'] = df_hist.unstack().to_frame(name='close')['close']
     tall['pnl'] = ptf_pnl.unstack().to_frame(name='pnl')['pnl']
     tall['logret'] = logret.unstack().to_frame(name='logret')['logret']
     tall['cumret'] = cumret.unstack().to_frame(name='cumret')['cumret']
-
-    # Rename the second index column to 'Date'
     tall.index.names = ['Ticker', 'Date']
 
     return tall
 
+def _synthetic_inputs(n_tickers, n_dates, seed=0):
+    """
+    Build a random portfolio and price history shaped like the app's inputs
+    """
+    rng = np.random.default_rng(seed)
+    tickers = [f"T{i:05d}" for i in range(n_tickers)]
+    dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=n_dates).date
+    log_moves = rng.normal(0.0003, 0.02, size=(n_dates, n_tickers))
+    prices = 100 * np.exp(np.cumsum(log_moves, axis=0))
+    df_hist = pd.DataFrame(prices, index=dates, columns=pd.Index(tickers, name='Ticker'))
+    ptf = pd.DataFrame({'Ticker': tickers[::-1], 'Shares': 100.0})
+    return ptf, df_hist
+
+def benchmark_perform_calculations(sizes=(500, 5000, 20000), n_dates=2520, legacy_max_tickers=5000):
+    """
+    Time perform_calculations() and measure its peak traced memory on synthetic data.
+    The original unstacking implementation is run alongside it up to legacy_max_tickers.
+    """
+    engines = {'numpy block': perform_calculations, 'unstacked (original)': _perform_calculations_unstacked}
+    rows = []
+    for n_tickers in sizes:
+        ptf, df_hist = _synthetic_inputs(n_tickers, n_dates)
+        for engine, func in engines.items():
+            if func is _perform_calculations_unstacked and n_tickers > legacy_max_tickers:
+                continue
+            tracemalloc.start()
+            start = time.perf_counter()
+            tall = func(ptf, df_hist)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rows.append({
+                'Tickers': n_tickers,
+                'Dates': n_dates,
+                'Engine': engine,
+                'Seconds': elapsed,
+                'Peak MB': peak / 2**20,
+                'Result MB': tall.memory_usage(index=False).sum() / 2**20
+            })
+            del tall
+    return pd.DataFrame(rows)
+
 def main():
     st.markdown("""
     ### Portfolio Calculations
@@ -84,7 +253,11 @@ def main():
         has_all_data = False
 
     if has_all_data:
-        tall = perform_calculations(ptf, df_hist)
+        # Only compute the new dates when the panel has already been calculated
+        if 'tall' in st.session_state:
+            tall = append_calculations(st.session_state['tall'], ptf, df_hist)
+        else:
+            tall = perform_calculations(ptf, df_hist)
 
         # Store the tall DataFrame in session state for use in other pages
         st.session_state['tall'] = tall
@@ -146,5 +319,13 @@ def main():
         st.write("below you can see the resulting *tall* dataframe")
         st.dataframe(tall)
 
+    # Benchmark the calculation engine on synthetic portfolios
+    with st.expander("Benchmark perform_calculations()"):
+        n_dates = st.number_input("Number of dates", min_value=20, max_value=5040, value=2520, step=252)
+        sizes = st.multiselect("Number of tickers", [500, 5000, 20000], default=[500, 5000])
+        if st.button("Run benchmark"):
+            with st.spinner("Running benchmark..."):
+                st.dataframe(benchmark_perform_calculations(sizes=sizes, n_dates=n_dates))
+
 if __name__ == "__main__":
     main()
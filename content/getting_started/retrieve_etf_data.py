@@ -3,21 +3,119 @@ import requests
 import pandas as pd
 import inspect
 import os
+import json
+import hashlib
+import tempfile
+import time
+import numpy as np
+import openpyxl
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+
+# The 11 Select Sector SPDR ETFs and their sector names
+SECTOR_NAMES = {
+    'XLU': 'Utilities',
+    'XLK': 'Technology',
+    'XLRE': 'Real Estate',
+    'XLB': 'Materials',
+    'XLI': 'Industrials',
+    'XLV': 'Health Care',
+    'XLF': 'Financials',
+    'XLE': 'Energy',
+    'XLP': 'Consumer Staples',
+    'XLY': 'Consumer Discretionary',
+    'XLC': 'Communication Services'
+}
+
+# Sector names as found in holdings files, mapped to their Select Sector SPDR ETF
+SECTOR_NAME_TO_ETF = {
+    'Utilities': 'XLU',
+    'Information Technology': 'XLK',
+    'Technology': 'XLK',
+    'Real Estate': 'XLRE',
+    'Materials': 'XLB',
+    'Industrials': 'XLI',
+    'Health Care': 'XLV',
+    'Healthcare': 'XLV',
+    'Financials': 'XLF',
+    'Financial': 'XLF',
+    'Energy': 'XLE',
+    'Consumer Staples': 'XLP',
+    'Consumer Discretionary': 'XLY',
+    'Communication Services': 'XLC',
+    'Communications': 'XLC',
+    'Telecommunication Services': 'XLC'
+}
+
+# Bump when a holdings parser changes so cached DataFrames are rebuilt
+HOLDINGS_CACHE_VERSION = 2
+
+# SPDR holdings columns returned as float64 by read_spdr_holdings()
+SPDR_NUMERIC_COLUMNS = ['Weight', 'Weight (%)', 'Price', 'Shares Held', 'Shares', 'Market Value']
+
+def fetch_with_cache(url, filename, parser, session=None):
+    """
+    Download url to filename and return parser(filename), skipping work when the file is unchanged.
+
+    Two sidecars are kept next to the file: <filename>.meta.json with the
+    ETag, Last-Modified and SHA-256 of the stored bytes, and <filename>.pkl
+    with the DataFrame parser() produced from them. The request is sent with
+    If-None-Match / If-Modified-Since; on a 304, or when the downloaded bytes
+    hash to the stored value, the pickled DataFrame is returned without
+    rewriting or re-parsing the file.
+    """
+    session = session or requests
+    meta_file = filename + '.meta.json'
+    parsed_file = filename + '.pkl'
 
-def get_etf_ptf(url):
-    filename = './data/CIND_holdings.csv'
-    
     # Create data directory if it doesn't exist
     os.makedirs(os.path.dirname(filename), exist_ok=True)
 
-    # Download the file
-    response = requests.get(url)
+    meta = {}
+    if os.path.exists(meta_file) and os.path.exists(parsed_file) and os.path.exists(filename):
+        with open(meta_file) as file:
+            meta = json.load(file)
+        if meta.get('version') != HOLDINGS_CACHE_VERSION:
+            meta = {}
+
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    # Download the file, conditionally when we hold a cached copy
+    response = session.get(url, headers=headers)
+    if response.status_code == 304 and meta:
+        return pd.read_pickle(parsed_file)
     response.raise_for_status()  # Check if the request was successful
 
-    # Save the file locally
-    with open(filename, 'wb') as file:
-        file.write(response.content)
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    if meta and content_hash == meta.get('sha256'):
+        parsed = pd.read_pickle(parsed_file)
+    else:
+        # Save the file locally and parse it
+        with open(filename, 'wb') as file:
+            file.write(response.content)
+        parsed = parser(filename)
+        parsed.to_pickle(parsed_file)
+
+    meta = {
+        'version': HOLDINGS_CACHE_VERSION,
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'sha256': content_hash
+    }
+    with open(meta_file, 'w') as file:
+        json.dump(meta, file)
+
+    return parsed
+
+def get_etf_ptf(url, session=None):
+    return fetch_with_cache(url, './data/CIND_holdings.csv', _read_etf_ptf, session)
 
+def _read_etf_ptf(filename):
     # Read the portfolio CSV file
     as_of_dt = pd.read_csv(filename, nrows=1).columns[1]
     as_of_dt = pd.to_datetime(as_of_dt).date()
@@ -49,33 +147,87 @@ def get_etf_ptf(url):
     
     return ptf
 
-def get_spy_etf(url):
-    filename = './data/SPY_holdings.xlsx'
-    
-    # Create data directory if it doesn't exist
-    os.makedirs(os.path.dirname(filename), exist_ok=True)
+def get_spy_etf(url, session=None):
+    return fetch_with_cache(url, './data/SPY_holdings.xlsx', _read_spy_etf, session)
 
-    # Download the file
-    response = requests.get(url)
-    response.raise_for_status()  # Check if the request was successful
+def _to_float(value):
+    """
+    Convert one spreadsheet cell to float: numbers pass through, strings may
+    carry thousands separators, anything else becomes NaN
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(',', ''))
+    except ValueError:
+        return np.nan
 
-    # Save the file locally
-    with open(filename, 'wb') as file:
-        file.write(response.content)
+def read_spdr_holdings(filename):
+    """
+    Read an SPDR holdings workbook in a single streaming pass.
 
-    # Read the portfolio Excel file, skipping the first 4 rows
-    spyder = pd.read_excel(filename, skiprows=4)  # Skip header rows
-    
-    # Get the as-of date from the third row, first column
+    The rows above the table hold fund metadata, including the "As of" date;
+    the table starts at the first row with a 'Ticker' cell and ends at the
+    first blank row (the disclaimers below it are skipped). Columns listed in
+    SPDR_NUMERIC_COLUMNS come back as float64.
+
+    Returns a tuple of (holdings DataFrame, as-of date or None when missing or unparseable)
+    """
+    workbook = openpyxl.load_workbook(filename, read_only=True, data_only=True)
     try:
-        date_df = pd.read_excel(filename, nrows=4)
-        date_text = date_df.iloc[2, 0]  # Third row, first column likely contains date
-        as_of_dt = pd.to_datetime(date_text.split("As of ")[-1]).date() if "As of" in date_text else pd.Timestamp.now().date()
-    except:
-        as_of_dt = pd.Timestamp.now().date()
+        sheet = workbook.worksheets[0]
+        # SPDR files do not always declare their dimensions correctly
+        sheet.reset_dimensions()
+        rows = sheet.iter_rows(values_only=True)
+
+        # Metadata rows up to the table header
+        as_of_dt = None
+        header = None
+        for row in rows:
+            if 'Ticker' in row:
+                header = row
+                break
+            for cell in row:
+                if isinstance(cell, str) and 'As of' in cell:
+                    # Unparseable dates are left to the callers' fallback to today
+                    try:
+                        as_of_dt = pd.to_datetime(cell.split('As of ')[-1]).date()
+                    except (ValueError, OverflowError):
+                        pass
+
+        # Table rows up to the first blank row
+        records = []
+        for row in rows:
+            if all(cell is None for cell in row):
+                break
+            records.append(row)
+    finally:
+        workbook.close()
+
+    if header is None:
+        return pd.DataFrame(), as_of_dt
+
+    # Build each column directly with its final dtype
+    columns = {}
+    for i, name in enumerate(header):
+        if name is None:
+            continue
+        values = [record[i] if i < len(record) else None for record in records]
+        if name in SPDR_NUMERIC_COLUMNS:
+            try:
+                columns[name] = np.array(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                columns[name] = np.array([_to_float(value) for value in values], dtype=np.float64)
+        else:
+            columns[name] = values
+    return pd.DataFrame(columns), as_of_dt
+
+def _read_spy_etf(filename):
+    # Read the holdings table and the as-of date in one pass over the workbook
+    spyder, as_of_dt = read_spdr_holdings(filename)
     
     # Add As Of Date column
-    spyder['As Of Date'] = as_of_dt
+    spyder['As Of Date'] = as_of_dt or pd.Timestamp.now().date()
        
     # Drop rows with Ticker = "-"
     spyder = spyder[spyder['Ticker'] != "-"]
@@ -88,75 +240,97 @@ def get_spy_etf(url):
     spyder = spyder.sort_values('Weight', ascending=False).reset_index(drop=True)
     return spyder
 
-def get_sector_etf(ticker):
+def _read_sector_etf(filename, ticker):
     """
-    Download and process holdings for a specific sector ETF
+    Parse a downloaded sector ETF holdings file
     """
-    url = f"https://www.ssga.com/us/en/intermediary/library-content/products/fund-data/etfs/us/holdings-daily-us-en-{ticker.lower()}.xlsx"
-    filename = f'./data/{ticker}_holdings.xlsx'
+    # Read the holdings table and the as-of date in one pass over the workbook
+    sector_etf, as_of_dt = read_spdr_holdings(filename)
     
-    # Create data directory if it doesn't exist
-    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    # Add As Of Date and Sector ETF columns
+    sector_etf['As Of Date'] = as_of_dt or pd.Timestamp.now().date()
+    sector_etf['Sector ETF'] = ticker
     
-    try:
-        # Download the file
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        # Save the file locally
-        with open(filename, 'wb') as file:
-            file.write(response.content)
-        
-        # Read the portfolio Excel file, skipping the first 4 rows (typical for SPDR ETFs)
-        sector_etf = pd.read_excel(filename, skiprows=4)
-        
-        # Get the as-of date
-        try:
-            date_df = pd.read_excel(filename, nrows=4)
-            date_text = date_df.iloc[2, 0]
-            as_of_dt = pd.to_datetime(date_text.split("As of ")[-1]).date() if "As of" in date_text else pd.Timestamp.now().date()
-        except:
-            as_of_dt = pd.Timestamp.now().date()
-        
-        # Add As Of Date and Sector ETF columns
-        sector_etf['As Of Date'] = as_of_dt
-        sector_etf['Sector ETF'] = ticker
-        
-        # Convert Weight column to float and filter rows with Weight > 0
-        if 'Weight' in sector_etf.columns:
-            # Handle both string and numeric formats
-            if sector_etf['Weight'].dtype == 'object':
-                sector_etf['Weight'] = pd.to_numeric(sector_etf['Weight'].astype(str).str.replace(',', ''), errors='coerce')
-            else:
-                sector_etf['Weight'] = pd.to_numeric(sector_etf['Weight'], errors='coerce')
-            sector_etf = sector_etf[sector_etf['Weight'] > 0]
-            sector_etf.rename(columns={'Weight': 'Weight (%)'}, inplace=True)
-        elif 'Weight (%)' in sector_etf.columns:
-            # Handle both string and numeric formats
-            if sector_etf['Weight (%)'].dtype == 'object':
-                sector_etf['Weight (%)'] = pd.to_numeric(sector_etf['Weight (%)'].astype(str).str.replace(',', ''), errors='coerce')
-            else:
-                sector_etf['Weight (%)'] = pd.to_numeric(sector_etf['Weight (%)'], errors='coerce')
-            sector_etf = sector_etf[sector_etf['Weight (%)'] > 0]
-        
-        # Convert numerical columns to float
-        for col in ['Price', 'Shares Held', 'Market Value', 'Shares']:
-            if col in sector_etf.columns:
-                # Handle both string and numeric formats
-                if sector_etf[col].dtype == 'object':
-                    sector_etf[col] = pd.to_numeric(sector_etf[col].astype(str).str.replace(',', ''), errors='coerce')
-                else:
-                    sector_etf[col] = pd.to_numeric(sector_etf[col], errors='coerce')
-        
-        # Drop rows with Ticker = "-" if any
-        sector_etf = sector_etf[sector_etf['Ticker'] != "-"]
-        
-        # Standardize column names as needed for consistency
-        if 'Shares Held' in sector_etf.columns and 'Shares' not in sector_etf.columns:
-            sector_etf.rename(columns={'Shares Held': 'Shares'}, inplace=True)
-        
-        return sector_etf
+    # Keep rows with a positive weight
+    if 'Weight' in sector_etf.columns:
+        sector_etf = sector_etf[sector_etf['Weight'] > 0]
+        sector_etf = sector_etf.rename(columns={'Weight': 'Weight (%)'})
+    elif 'Weight (%)' in sector_etf.columns:
+        sector_etf = sector_etf[sector_etf['Weight (%)'] > 0]
+    
+    # Drop rows with Ticker = "-" if any
+    sector_etf = sector_etf[sector_etf['Ticker'] != "-"]
+    
+    # Standardize column names as needed for consistency
+    if 'Shares Held' in sector_etf.columns and 'Shares' not in sector_etf.columns:
+        sector_etf = sector_etf.rename(columns={'Shares Held': 'Shares'})
     
+    return sector_etf
+
+def _synthetic_spdr_workbook(filename, n_holdings=500, seed=0):
+    """
+    Write a workbook laid out like an SPDR daily holdings file
+    """
+    rng = np.random.default_rng(seed)
+    weights = rng.random(n_holdings)
+    weights = weights / weights.sum() * 100
+
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['Fund Name:', 'SPDR Synthetic ETF'])
+    sheet.append(['Ticker Symbol:', 'SYN'])
+    sheet.append(['Holdings:', f"As of {pd.Timestamp.now():%d-%b-%Y}"])
+    sheet.append([])
+    sheet.append(['Name', 'Ticker', 'Identifier', 'SEDOL', 'Weight', 'Sector', 'Shares Held', 'Local Currency'])
+    for i in range(n_holdings):
+        shares = f"{int(rng.integers(1_000, 10_000_000)):,}"
+        sheet.append([f"Company {i}", f"T{i:04d}", f"ID{i:06d}", f"S{i:06d}", weights[i], 'Sector', shares, 'USD'])
+    sheet.append([])
+    sheet.append(['Past performance is not a reliable indicator of future performance.'])
+    workbook.save(filename)
+
+def benchmark_spdr_reader(filename=None, n_holdings=500, repeat=5):
+    """
+    Compare read_spdr_holdings() with the previous two read_excel passes plus
+    string cleanup. Uses a synthetic SPDR-style workbook unless filename is given.
+    """
+    def read_twice(path):
+        holdings = pd.read_excel(path, skiprows=4)
+        pd.read_excel(path, nrows=4)
+        for col in ['Weight', 'Shares Held']:
+            if holdings[col].dtype == 'object':
+                holdings[col] = pd.to_numeric(holdings[col].astype(str).str.replace(',', ''), errors='coerce')
+        return holdings
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if filename is None:
+            filename = os.path.join(tmp, 'SYN_holdings.xlsx')
+            _synthetic_spdr_workbook(filename, n_holdings)
+        rows = []
+        for reader, func in [('read_excel x2 (previous)', read_twice), ('read_spdr_holdings', read_spdr_holdings)]:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                func(filename)
+                timings.append(time.perf_counter() - start)
+            rows.append({'Reader': reader, 'Best seconds': min(timings), 'Mean seconds': np.mean(timings)})
+    return pd.DataFrame(rows)
+
+def _fetch_sector_etf(ticker, session):
+    """
+    Download and parse the holdings file of one sector ETF, raising on failure.
+    Safe to run in a worker thread: it does not touch Streamlit.
+    """
+    url = f"https://www.ssga.com/us/en/intermediary/library-content/products/fund-data/etfs/us/holdings-daily-us-en-{ticker.lower()}.xlsx"
+    filename = f'./data/{ticker}_holdings.xlsx'
+    return fetch_with_cache(url, filename, lambda path: _read_sector_etf(path, ticker), session)
+
+def get_sector_etf(ticker, session=None):
+    """
+    Download and process holdings for a specific sector ETF
+    """
+    try:
+        return _fetch_sector_etf(ticker, session or requests)
     except Exception as e:
         st.error(f"Error downloading {ticker} ETF data: {str(e)}")
         return pd.DataFrame()
@@ -164,36 +338,93 @@ def get_sector_etf(ticker):
 def download_all_sector_etfs():
     """
     Download all 11 Select Sector SPDR ETFs and return consolidated holdings
+
+    The files are fetched and parsed concurrently on a thread pool sharing one
+    connection-pooled session; progress is reported as each file finishes and
+    the holdings are concatenated once at the end.
     """
-    sector_tickers = ['XLU', 'XLK', 'XLRE', 'XLB', 'XLI', 'XLV', 'XLF', 'XLE', 'XLP', 'XLY', 'XLC']
-    sector_names = {
-        'XLU': 'Utilities',
-        'XLK': 'Technology',
-        'XLRE': 'Real Estate',
-        'XLB': 'Materials',
-        'XLI': 'Industrials',
-        'XLV': 'Health Care',
-        'XLF': 'Financials',
-        'XLE': 'Energy',
-        'XLP': 'Consumer Staples',
-        'XLY': 'Consumer Discretionary',
-        'XLC': 'Communication Services'
-    }
-    
-    all_sectors = {}
-    sector_holdings = pd.DataFrame()
-    
-    for ticker in sector_tickers:
-        with st.spinner(f'Downloading {ticker} sector ETF data...'):
-            sector_df = get_sector_etf(ticker)
-            if not sector_df.empty:
-                sector_df['Sector'] = sector_names.get(ticker, ticker)
-                sector_holdings = pd.concat([sector_holdings, sector_df], ignore_index=True)
-                all_sectors[ticker] = sector_df
-                st.success(f"Downloaded {ticker} with {len(sector_df)} holdings")
-    
+    sector_tickers = list(SECTOR_NAMES)
+
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_maxsize=len(sector_tickers)))
+
+    downloaded = {}
+    progress = st.progress(0.0, text='Downloading sector ETF data...')
+    with ThreadPoolExecutor(max_workers=len(sector_tickers)) as pool:
+        futures = {pool.submit(_fetch_sector_etf, ticker, session): ticker for ticker in sector_tickers}
+        for done, future in enumerate(as_completed(futures), start=1):
+            ticker = futures[future]
+            try:
+                sector_df = future.result()
+            except Exception as e:
+                st.error(f"Error downloading {ticker} ETF data: {str(e)}")
+            else:
+                if not sector_df.empty:
+                    sector_df['Sector'] = SECTOR_NAMES[ticker]
+                    downloaded[ticker] = sector_df
+                    st.success(f"Downloaded {ticker} with {len(sector_df)} holdings")
+            progress.progress(done / len(sector_tickers), text=f'Downloaded {done} of {len(sector_tickers)} sector ETFs')
+    progress.empty()
+
+    # Keep the usual sector order and concatenate once
+    all_sectors = {ticker: downloaded[ticker] for ticker in sector_tickers if ticker in downloaded}
+    sector_holdings = pd.concat(all_sectors.values(), ignore_index=True) if all_sectors else pd.DataFrame()
+
     return all_sectors, sector_holdings
 
+def build_ticker_sector_map(sector_holdings):
+    """
+    Build a deduplicated Ticker -> Sector ETF lookup from the sector ETF holdings.
+
+    A ticker that appears in more than one sector ETF is assigned to the ETF
+    where it has the highest weight; equal weights go to the ETF that sorts
+    first alphabetically. Returns a Series indexed by unique, sorted tickers.
+    """
+    columns = ['Ticker', 'Sector ETF'] + [col for col in ['Weight (%)'] if col in sector_holdings.columns]
+    holdings = sector_holdings[columns].dropna(subset=['Ticker', 'Sector ETF'])
+    if 'Weight (%)' not in holdings.columns:
+        holdings = holdings.assign(**{'Weight (%)': 0.0})
+
+    # One stable sort puts the winning row first within each ticker
+    holdings = holdings.sort_values(
+        ['Ticker', 'Weight (%)', 'Sector ETF'], ascending=[True, False, True], kind='mergesort'
+    )
+    return holdings.drop_duplicates('Ticker').set_index('Ticker')['Sector ETF']
+
+@st.cache_data(show_spinner=False)
+def cached_ticker_sector_map(sector_holdings):
+    """
+    build_ticker_sector_map() cached across reruns and sessions for the same holdings
+    """
+    return build_ticker_sector_map(sector_holdings)
+
+def benchmark_sector_mapping(n_rows=100_000, seed=0):
+    """
+    Time the previous iterrows() loop against build_ticker_sector_map() on
+    synthetic holdings where about a third of the tickers sit in two sector ETFs
+    """
+    rng = np.random.default_rng(seed)
+    n_tickers = int(n_rows * 0.75)
+    holdings = pd.DataFrame({
+        'Ticker': [f"T{i:06d}" for i in rng.integers(0, n_tickers, n_rows)],
+        'Sector ETF': rng.choice(list(SECTOR_NAMES), n_rows),
+        'Weight (%)': rng.random(n_rows)
+    })
+
+    def iterrows_map(sector_holdings):
+        ticker_to_sector_map = {}
+        for _, row in sector_holdings.iterrows():
+            ticker_to_sector_map[row['Ticker']] = row['Sector ETF']
+        return ticker_to_sector_map
+
+    rows = []
+    for method, func in [('iterrows (previous)', iterrows_map), ('build_ticker_sector_map', build_ticker_sector_map)]:
+        start = time.perf_counter()
+        mapping = func(holdings)
+        rows.append({'Method': method, 'Holdings rows': n_rows, 'Tickers': len(mapping),
+                     'Seconds': time.perf_counter() - start})
+    return pd.DataFrame(rows)
+
 def map_spy_to_sectors(spy_df, sector_holdings):
     """
     Map SPY holdings to their corresponding sectors based on sector ETF holdings
@@ -202,44 +433,17 @@ def map_spy_to_sectors(spy_df, sector_holdings):
     sector ETFs first, then applies this mapping to the SPY holdings.
     """
     # Create a comprehensive mapping of tickers to sectors from all sector ETF holdings
-    ticker_to_sector_map = {}
-    
-    # Process all sector holdings to create the mapping
-    for _, row in sector_holdings.iterrows():
-        ticker = row['Ticker']
-        sector_etf = row['Sector ETF']
-        # If there are multiple sectors for a ticker, we'll use the latest one
-        # (could be enhanced to use the one with highest weight if needed)
-        ticker_to_sector_map[ticker] = sector_etf
+    # (a ticker held by several sector ETFs goes to the one where its weight is highest)
+    ticker_to_sector_map = cached_ticker_sector_map(sector_holdings)
     
     # Apply the mapping to SPY holdings
     spy_df['Sector ETF'] = spy_df['Ticker'].map(ticker_to_sector_map)
     
     # For any missing sectors, try to fill with sector information if available in SPY data
     if 'Sector' in spy_df.columns:
-        # Create a sector name to ETF ticker mapping
-        sector_name_to_etf = {
-            'Utilities': 'XLU',
-            'Information Technology': 'XLK',
-            'Technology': 'XLK',
-            'Real Estate': 'XLRE',
-            'Materials': 'XLB',
-            'Industrials': 'XLI',
-            'Health Care': 'XLV',
-            'Healthcare': 'XLV',
-            'Financials': 'XLF',
-            'Financial': 'XLF',
-            'Energy': 'XLE',
-            'Consumer Staples': 'XLP',
-            'Consumer Discretionary': 'XLY',
-            'Communication Services': 'XLC',
-            'Communications': 'XLC',
-            'Telecommunication Services': 'XLC'
-        }
-        
         # Fill missing Sector ETF values using the sector name mapping
         missing_sector_mask = spy_df['Sector ETF'].isna()
-        spy_df.loc[missing_sector_mask, 'Sector ETF'] = spy_df.loc[missing_sector_mask, 'Sector'].map(sector_name_to_etf)
+        spy_df.loc[missing_sector_mask, 'Sector ETF'] = spy_df.loc[missing_sector_mask, 'Sector'].map(SECTOR_NAME_TO_ETF)
     
     # Ensure there are no NaN values in Weight (%) column
     if 'Weight (%)' in spy_df.columns:
@@ -281,21 +485,7 @@ def create_synthetic_sector_portfolio(spy_df):
     sector_weights = sector_weights.sort_values('Weight (%)', ascending=False).reset_index(drop=True)
     
     # Add descriptive sector names
-    sector_names = {
-        'XLU': 'Utilities',
-        'XLK': 'Technology',
-        'XLRE': 'Real Estate',
-        'XLB': 'Materials',
-        'XLI': 'Industrials',
-        'XLV': 'Health Care',
-        'XLF': 'Financials',
-        'XLE': 'Energy',
-        'XLP': 'Consumer Staples',
-        'XLY': 'Consumer Discretionary',
-        'XLC': 'Communication Services'
-    }
-    
-    sector_weights['Sector Name'] = sector_weights['Sector ETF'].map(sector_names)
+    sector_weights['Sector Name'] = sector_weights['Sector ETF'].map(SECTOR_NAMES)
     
     # Calculate shares and market value (assuming $100,000 portfolio and $100/share price for simplicity)
     total_investment = 100000.0
@@ -453,20 +643,28 @@ def main():
         st.subheader("ETF Data Function Code Snippets")
         
         if st.checkbox('View get_etf_ptf function (CIND)'):
-            source_code = inspect.getsource(get_etf_ptf)
+            source_code = inspect.getsource(get_etf_ptf) + '\n' + inspect.getsource(_read_etf_ptf)
             st.code(source_code, language='python')
             
         if st.checkbox('View get_spy_etf function (SPY)'):
-            source_code = inspect.getsource(get_spy_etf)
+            source_code = inspect.getsource(get_spy_etf) + '\n' + inspect.getsource(_read_spy_etf)
             st.code(source_code, language='python')
             
         if st.checkbox('View get_sector_etf function'):
-            source_code = inspect.getsource(get_sector_etf)
+            source_code = inspect.getsource(get_sector_etf) + '\n' + inspect.getsource(_read_sector_etf)
             st.code(source_code, language='python')
             
         if st.checkbox('View create_synthetic_sector_portfolio function'):
             source_code = inspect.getsource(create_synthetic_sector_portfolio)
             st.code(source_code, language='python')
 
+        if st.button('Benchmark the ticker to sector mapping'):
+            with st.spinner('Mapping 100,000 synthetic holdings rows...'):
+                st.dataframe(benchmark_sector_mapping())
+
+        if st.button('Benchmark the SPDR holdings reader'):
+            with st.spinner('Reading a synthetic 500-holding workbook...'):
+                st.dataframe(benchmark_spdr_reader())
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
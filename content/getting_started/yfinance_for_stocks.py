@@ -1,23 +1,350 @@
 import streamlit as st
 import yfinance as yf
 import pandas as pd
-from datetime import date, timedelta
+import numpy as np
+import json
+import os
+import time
+import threading
+import zlib
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 from curl_cffi import requests  # NEW IMPORT
+from yfinance.exceptions import YFPricesMissingError
 
-def get_adj_close_prices(tickers):
-    # Use curl_cffi requests to impersonate Chrome
-    session = requests.Session(impersonate="chrome")
-    # Download historical market data for the given tickers from Yahoo Finance using the custom session
-    data = yf.download(
-        tickers,
-        period="1y",
-        auto_adjust=True,
-        ignore_tz=True,
-        session=session  # Pass the impersonated session
-    )
-    data.index = data.index.date
-    adj_close_prices = data['Close']
-    return adj_close_prices
+# Local columnar price store: one Parquet file of (Date, Ticker, Close) rows per
+# month plus a coverage file recording the date range requested for each ticker
+PRICE_STORE_DIR = './data/prices'
+COVERAGE_FILE = 'coverage.json'
+# Tickers that returned no prices (delisted, renamed, failed) are not requested
+# again until FAILURE_TTL has passed
+FAILURES_FILE = 'failures.json'
+FAILURE_TTL = timedelta(hours=12)
+
+def fetch_chunk_history(tickers, start, end, session):
+    """
+    Fetch adjusted closes for one chunk of tickers, one history request per ticker.
+    yf.download keeps its results in module-level state, so chunks running in
+    parallel go through Ticker.history instead.
+    A range without any trading day (weekend, holiday) is not an error: the
+    ticker is simply left out of the closes.
+    Returns (wide DataFrame of the tickers that returned prices, {ticker: error message})
+    """
+    closes, errors = {}, {}
+    for ticker in tickers:
+        try:
+            history = yf.Ticker(ticker, session=session).history(
+                start=start, end=end, auto_adjust=True, raise_errors=True
+            )
+            if not history.empty:
+                closes[ticker] = history['Close'].set_axis(history.index.tz_localize(None).date)
+        except YFPricesMissingError:
+            pass
+        except Exception as e:
+            errors[ticker] = str(e)
+    return pd.DataFrame(closes), errors
+
+def download_close_prices_chunked(tickers, start, end, chunk_size=50, max_workers=8, max_retries=3,
+                                  backoff=1.0, fetch_chunk=fetch_chunk_history, session=None):
+    """
+    Download closes for a large ticker universe in parallel chunks.
+
+    The universe is split into chunks of chunk_size tickers that run on a
+    pool of max_workers threads sharing one curl_cffi session (it keeps a
+    connection pool per thread). Tickers that fail are retried up to
+    max_retries times with exponential backoff (backoff, 2 * backoff, ...).
+
+    fetch_chunk(tickers, start, end, session) must return the same pair as
+    fetch_chunk_history(). Returns (wide Close DataFrame, report) where report
+    is indexed by Ticker with the columns Status, Attempts and Error.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    if session is None:
+        session = requests.Session(impersonate="chrome")
+
+    def run_chunk(chunk):
+        frames, report = [], {}
+        pending = chunk
+        for attempt in range(1, max_retries + 2):
+            try:
+                closes, errors = fetch_chunk(pending, start, end, session)
+            except Exception as e:
+                closes, errors = pd.DataFrame(), {ticker: str(e) for ticker in pending}
+            frames.append(closes)
+            for ticker in pending:
+                report[ticker] = ('failed' if ticker in errors else 'ok', attempt, errors.get(ticker, ''))
+            pending = [ticker for ticker in pending if ticker in errors]
+            if not pending or attempt > max_retries:
+                break
+            time.sleep(backoff * 2 ** (attempt - 1))
+        return frames, report
+
+    chunks = [tickers[i:i + chunk_size] for i in range(0, len(tickers), chunk_size)]
+    frames, report = [], {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for chunk_frames, chunk_report in pool.map(run_chunk, chunks):
+            frames.extend(chunk_frames)
+            report.update(chunk_report)
+
+    # Assemble the same wide frame yf.download returns: sorted tickers, one row per date
+    frames = [frame for frame in frames if not frame.empty]
+    close = pd.concat(frames, axis=1).sort_index() if frames else pd.DataFrame(index=pd.Index([]))
+    close = close.reindex(columns=sorted(tickers))
+    close.columns.name = 'Ticker'
+    report = pd.DataFrame.from_dict(report, orient='index', columns=['Status', 'Attempts', 'Error'])
+    report.index.name = 'Ticker'
+    return close, report.loc[tickers]
+
+def download_close_prices(tickers, start, end):
+    """
+    Download adjusted close prices from Yahoo Finance for [start, end)
+    Returns (wide DataFrame indexed by date with one column per ticker,
+    report by ticker), like download_close_prices_chunked()
+    """
+    close, report = download_close_prices_chunked(tickers, start, end)
+    failed = report.index[report['Status'] == 'failed']
+    if len(failed):
+        st.warning(f"Could not download {len(failed)} tickers: {', '.join(failed)}")
+    return close, report
+
+class _FakeQuoteHandler(BaseHTTPRequestHandler):
+    """
+    Serves deterministic close prices for /history?symbol=XYZ after a fixed delay
+    """
+    latency = 0.05
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        time.sleep(self.latency)
+        rng = np.random.default_rng(zlib.crc32(query['symbol'][0].encode()))
+        body = json.dumps({'close': (100 + rng.normal(size=252).cumsum()).tolist()}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def benchmark_chunked_download(n_tickers=500, latency=0.05, configs=((500, 1), (50, 4), (50, 8), (25, 16))):
+    """
+    Measure download throughput against a local fake quote server.
+    Each config is (chunk_size, max_workers). The (n_tickers, 1) baseline is a
+    serial per-ticker loop, one request at a time, not the old single
+    yf.download batch (which threads its requests and cannot be pointed at
+    the fake server).
+    """
+    handler = type('Handler', (_FakeQuoteHandler,), {'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/history"
+    dates = pd.bdate_range(end='2024-12-31', periods=252).date
+
+    def fetch_chunk(tickers, start, end, session):
+        closes = {ticker: session.get(url, params={'symbol': ticker}).json()['close'] for ticker in tickers}
+        return pd.DataFrame(closes, index=dates), {}
+
+    tickers = [f"T{i:04d}" for i in range(n_tickers)]
+    rows = []
+    try:
+        for chunk_size, max_workers in configs:
+            begin = time.perf_counter()
+            close, report = download_close_prices_chunked(
+                tickers, None, None, chunk_size=chunk_size, max_workers=max_workers, fetch_chunk=fetch_chunk
+            )
+            elapsed = time.perf_counter() - begin
+            rows.append({
+                'Mode': 'serial per-ticker' if max_workers == 1 else 'chunked parallel',
+                'Chunk size': chunk_size,
+                'Workers': max_workers,
+                'Seconds': elapsed,
+                'Tickers/s': n_tickers / elapsed,
+                'Succeeded': int((report['Status'] == 'ok').sum())
+            })
+    finally:
+        server.shutdown()
+        server.server_close()
+    return pd.DataFrame(rows)
+
+def _month_file(store_dir, month):
+    return os.path.join(store_dir, f"{month:%Y-%m}.parquet")
+
+def _months(start, end):
+    """All month starts touched by the half-open date range [start, end)"""
+    return pd.period_range(start, end - timedelta(days=1), freq='M').to_timestamp()
+
+def load_coverage(store_dir=PRICE_STORE_DIR):
+    """
+    Read the date range [start, end) stored for each ticker
+    """
+    path = os.path.join(store_dir, COVERAGE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        coverage = json.load(file)
+    return {ticker: (date.fromisoformat(start), date.fromisoformat(end)) for ticker, (start, end) in coverage.items()}
+
+def _save_coverage(coverage, store_dir):
+    path = os.path.join(store_dir, COVERAGE_FILE)
+    with open(path + '.tmp', 'w') as file:
+        json.dump({ticker: [start.isoformat(), end.isoformat()] for ticker, (start, end) in coverage.items()}, file)
+    os.replace(path + '.tmp', path)
+
+def load_failures(store_dir=PRICE_STORE_DIR, now=None):
+    """
+    Read the tickers that recently returned no prices, with the time after
+    which they may be requested again and the error. Expired entries are left out.
+    """
+    path = os.path.join(store_dir, FAILURES_FILE)
+    if not os.path.exists(path):
+        return {}
+    now = now or datetime.now()
+    with open(path) as file:
+        failures = json.load(file)
+    failures = {ticker: (datetime.fromisoformat(retry_after), error) for ticker, (retry_after, error) in failures.items()}
+    return {ticker: entry for ticker, entry in failures.items() if entry[0] > now}
+
+def _save_failures(failures, store_dir):
+    path = os.path.join(store_dir, FAILURES_FILE)
+    with open(path + '.tmp', 'w') as file:
+        json.dump({ticker: [retry_after.isoformat(), error] for ticker, (retry_after, error) in failures.items()}, file)
+    os.replace(path + '.tmp', path)
+
+def _missing_ranges(coverage, tickers, start, end):
+    """
+    Group tickers by the date range that still has to be downloaded.
+
+    A ticker with no coverage needs [start, end). A covered ticker only needs
+    the gap before its first stored date and the range from its last stored
+    date onwards (the last date is fetched again to pick up intraday updates).
+    """
+    missing = {}
+    for ticker in tickers:
+        if ticker not in coverage:
+            missing.setdefault((start, end), []).append(ticker)
+            continue
+        covered_start, covered_end = coverage[ticker]
+        if start < covered_start:
+            missing.setdefault((start, covered_start), []).append(ticker)
+        last_stored = covered_end - timedelta(days=1)
+        if last_stored < end:
+            missing.setdefault((last_stored, end), []).append(ticker)
+    return missing
+
+def _merge_into_store(prices, store_dir):
+    """
+    Write downloaded prices into the monthly files, new values taking precedence
+    """
+    rows = prices.rename_axis(index='Date', columns='Ticker').stack().rename('Close').reset_index()
+    if rows.empty:
+        return
+    months = pd.to_datetime(rows['Date']).dt.to_period('M')
+    for month in months.unique():
+        path = _month_file(store_dir, month.to_timestamp())
+        update = rows[months == month]
+        if os.path.exists(path):
+            update = pd.concat([pd.read_parquet(path), update], ignore_index=True)
+            update = update.drop_duplicates(['Date', 'Ticker'], keep='last')
+        update = update.sort_values(['Date', 'Ticker'], ignore_index=True)
+        pq.write_table(pa.Table.from_pandas(update, preserve_index=False), path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+def update_price_store(tickers, start, end, downloader=download_close_prices, store_dir=PRICE_STORE_DIR):
+    """
+    Download only the date ranges not yet stored for each ticker and merge them in.
+
+    downloader(tickers, start, end) must return a wide DataFrame of closes
+    indexed by date and a report by ticker with an Error column, like
+    download_close_prices(). Returns the number of download calls made.
+
+    Coverage is recorded for tickers that returned prices, and extended for
+    stored tickers whose range had no trading day (weekend, holiday, before
+    the open). Tickers the downloader reports an error for, and tickers with
+    no stored prices that returned none (delisted names), go to a negative
+    cache with their error and are skipped until FAILURE_TTL has passed,
+    then retried over the whole missing range.
+
+    Stored closes are not re-adjusted when a later dividend or split changes
+    Yahoo's adjusted history; delete the store to rebuild it from scratch.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    coverage = load_coverage(store_dir)
+    failures = load_failures(store_dir)
+    missing = _missing_ranges(coverage, [ticker for ticker in tickers if ticker not in failures], start, end)
+    retry_after = datetime.now() + FAILURE_TTL
+
+    for (fetch_start, fetch_end), fetch_tickers in missing.items():
+        prices, report = downloader(fetch_tickers, fetch_start, fetch_end)
+        _merge_into_store(prices, store_dir)
+        returned = set(prices.columns[prices.notna().any()])
+        for ticker in fetch_tickers:
+            error = report['Error'].get(ticker) if 'Error' in report else None
+            if ticker in returned or (ticker in coverage and not error):
+                covered_start, covered_end = coverage.get(ticker, (fetch_start, fetch_end))
+                coverage[ticker] = (min(covered_start, fetch_start), max(covered_end, fetch_end))
+                failures.pop(ticker, None)
+            else:
+                failures[ticker] = (retry_after, error or 'no price data returned')
+
+    _save_coverage(coverage, store_dir)
+    _save_failures(failures, store_dir)
+    return len(missing)
+
+def load_price_store(tickers, start, end, store_dir=PRICE_STORE_DIR):
+    """
+    Read stored closes for tickers in [start, end) from the monthly files.
+    Returns None unless every ticker's stored range covers the request;
+    tickers in the negative cache count as covered, with whatever prices
+    they have stored (none for a ticker that never returned any).
+    """
+    coverage = load_coverage(store_dir)
+    failures = load_failures(store_dir)
+    if not all(ticker in failures or (ticker in coverage and coverage[ticker][0] <= start and coverage[ticker][1] >= end)
+               for ticker in tickers):
+        return None
+
+    paths = [_month_file(store_dir, month) for month in _months(start, end)]
+    paths = [path for path in paths if os.path.exists(path)]
+    if paths:
+        rows = pa.concat_tables([pq.read_table(path) for path in paths]).to_pandas()
+        rows = rows[(rows['Date'] >= start) & (rows['Date'] < end) & rows['Ticker'].isin(tickers)]
+        prices = rows.pivot(index='Date', columns='Ticker', values='Close')
+    else:
+        prices = pd.DataFrame()
+    prices = prices.reindex(columns=sorted(tickers))
+    prices.index.name = None
+    prices.columns.name = 'Ticker'
+    return prices
+
+def _one_year_window():
+    end = date.today() + timedelta(days=1)
+    return end - timedelta(days=366), end
+
+def get_adj_close_prices(tickers, downloader=download_close_prices, store_dir=PRICE_STORE_DIR):
+    """
+    Return one year of adjusted close prices, downloading only what the local
+    price store is missing
+    """
+    start, end = _one_year_window()
+    update_price_store(tickers, start, end, downloader=downloader, store_dir=store_dir)
+    return load_price_store(tickers, start, end, store_dir=store_dir)
+
+def get_stored_adj_close_prices(tickers, store_dir=PRICE_STORE_DIR):
+    """
+    Return one year of adjusted close prices from disk only, without touching the
+    network. The most recent day may be stale until the next refresh.
+    Returns None if the store does not cover every ticker.
+    """
+    start, end = _one_year_window()
+    coverage = load_coverage(store_dir)
+    # Accept a store that was last refreshed on an earlier day
+    stored_end = min((coverage[ticker][1] for ticker in tickers if ticker in coverage), default=start)
+    return load_price_store(tickers, start, min(end, stored_end), store_dir=store_dir)
 
 def main():
     st.subheader("yfinance for Stocks")
@@ -36,6 +363,13 @@ def main():
 
     st.write("Count of tickers: " + f"{len(tickers)}")
 
+    # Serve a previously downloaded history from the local price store
+    if 'df_hist' not in st.session_state:
+        df_hist = get_stored_adj_close_prices(tickers)
+        if df_hist is not None and not df_hist.empty:
+            st.session_state['df_hist'] = df_hist
+            st.info(f'Loaded adjusted close prices from the local price store ({PRICE_STORE_DIR}).')
+
     # Fetch adjusted close prices
     if 'df_hist' not in st.session_state:
         st.info('No adjusted close prices in session state.')
@@ -45,9 +379,16 @@ def main():
             st.session_state['df_hist'] = df_hist
             st.rerun()
     else:
-        # Button to refresh the adjusted close prices
+        # Button to refresh the adjusted close prices (only the missing dates are downloaded)
         if st.button("Refresh"):
             df_hist = get_adj_close_prices(tickers)
             st.session_state['df_hist'] = df_hist
         df_hist = st.session_state['df_hist']
         st.dataframe(df_hist)
+
+    with st.expander("Benchmark the chunked downloader"):
+        st.write("Downloads synthetic prices from a local fake quote server with 50ms latency per request. "
+                 "The baseline fetches one ticker at a time (serial per-ticker).")
+        if st.button("Run download benchmark"):
+            with st.spinner("Running benchmark..."):
+                st.dataframe(benchmark_chunked_download())
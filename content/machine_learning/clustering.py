@@ -3,8 +3,143 @@ import pandas as pd
 import numpy as np
 import scipy.cluster.hierarchy
 import plotly.express as px
+from panel_store import get_panel, get_linkage, memoize
+import time
+import tracemalloc
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.metrics import adjusted_rand_score
 from sklearn.preprocessing import StandardScaler
 
+# Above this many assets the page defaults to the large-universe backend
+LARGE_UNIVERSE_THRESHOLD = 2000
+
+# Most clusters listed one by one at the bottom of the page
+MAX_LISTED_CLUSTERS = 200
+
+# Up to this many assets every cut of the tree is computed up front
+MAX_PRECOMPUTED_CUTS = 2000
+
+def compute_features(logret):
+    """Annualized return and volatility of every asset."""
+    return pd.DataFrame({
+        'Annualized Return': logret.mean() * 252,
+        'Annualized Volatility': logret.std() * np.sqrt(252)
+    })
+
+def scale_features(features_df, cluster_on):
+    """Standardize the selected features (excluding 'Correlation') to give them equal weight."""
+    feature_list = [f for f in cluster_on if f != 'Correlation']
+    return StandardScaler().fit_transform(features_df[feature_list])
+
+def build_hierarchy(tall, tickers, features_df, cluster_on):
+    """
+    Average-linkage tree of the assets and, up to MAX_PRECOMPUTED_CUTS assets,
+    the labels of every cut from N clusters down to 1.
+
+    Returns:
+        dict with the linkage matrix 'z' and the label matrix 'cuts'
+        (assets x N, column j holding the N - j cluster cut) or None
+    """
+    if cluster_on == ['Correlation']:
+        # Cluster on correlation distance (as before), sharing the cached tree
+        z = get_linkage(tall, tickers, method='average')
+    else:
+        # Use euclidean distance for multi-feature clustering
+        z = scipy.cluster.hierarchy.linkage(scale_features(features_df, cluster_on), method='average', metric='euclidean')
+
+    cuts = None
+    if len(tickers) <= MAX_PRECOMPUTED_CUTS:
+        # Numbered from 1, like fcluster
+        cuts = (scipy.cluster.hierarchy.cut_tree(z) + 1).astype(np.int32)
+    return {'z': z, 'cuts': cuts}
+
+def cut_labels(hierarchy, n_clusters):
+    """Cluster labels for n_clusters: a column of the precomputed cuts, or fcluster on the cached tree."""
+    cuts = hierarchy['cuts']
+    if cuts is not None:
+        return cuts[:, len(cuts) - n_clusters]
+    return scipy.cluster.hierarchy.fcluster(hierarchy['z'], n_clusters, criterion='maxclust')
+
+def return_embeddings(logret, n_components=32, random_state=0):
+    """
+    Low-dimensional embedding of each asset's standardized return history.
+
+    Returns are standardized per asset (missing days count as the mean) and
+    projected on their leading singular vectors with TruncatedSVD. Rows are
+    scaled to unit length, so the squared euclidean distance between two
+    embeddings approximates 2 * (1 - correlation) without forming the N x N matrix.
+
+    Returns:
+        (assets x n_components) array
+    """
+    values = logret.to_numpy(dtype=float)
+    mean = np.nanmean(values, axis=0)
+    std = np.nanstd(values, axis=0)
+    standardized = np.nan_to_num((values - mean) / np.where(std > 0, std, 1.0))
+
+    n_components = max(1, min(n_components, min(standardized.shape) - 1))
+    svd = TruncatedSVD(n_components=n_components, random_state=random_state)
+    embedding = svd.fit_transform(standardized.T)
+    norms = np.linalg.norm(embedding, axis=1, keepdims=True)
+    return embedding / np.where(norms > 0, norms, 1.0)
+
+def kmeans_labels(embedding, n_clusters, random_state=0):
+    """Mini-batch k-means labels (numbered from 1, like fcluster) of the rows of embedding."""
+    model = MiniBatchKMeans(n_clusters=n_clusters, batch_size=2048, n_init=3, random_state=random_state)
+    return model.fit_predict(embedding) + 1
+
+def _synthetic_block_returns(n_tickers, n_dates, n_blocks, seed=0):
+    """Returns driven by one factor per block of assets, with the true block labels."""
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, n_blocks, size=n_tickers)
+    factors = rng.normal(0, 0.01, size=(n_dates, n_blocks))
+    values = factors[:, blocks] + rng.normal(0, 0.03, size=(n_dates, n_tickers))
+    return pd.DataFrame(values, columns=[f"T{i:05d}" for i in range(n_tickers)]), blocks
+
+def _measure(func):
+    """Run func, returning its result, the seconds taken and the peak traced memory in MB."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return result, seconds, peak
+
+def benchmark_clustering(sizes=(1000, 3000, 5000), n_dates=756, n_blocks=20, linkage_max_tickers=5000):
+    """
+    Compare the average-linkage path with the large-universe backend on
+    synthetic block-structured returns: time, peak memory and the adjusted
+    Rand index of the recovered clusters against the true blocks.
+
+    Returns:
+        DataFrame with one row per universe size and backend
+    """
+    rows = []
+    for n_tickers in sizes:
+        logret, blocks = _synthetic_block_returns(n_tickers, n_dates, n_blocks)
+
+        def linkage_path():
+            corr_condensed = scipy.cluster.hierarchy.distance.squareform(1 - np.corrcoef(logret.to_numpy().T), checks=False)
+            z = scipy.cluster.hierarchy.linkage(corr_condensed, method='average')
+            return scipy.cluster.hierarchy.fcluster(z, n_blocks, criterion='maxclust')
+
+        def large_universe_path():
+            return kmeans_labels(return_embeddings(logret), n_blocks)
+
+        backends = {'Average linkage': linkage_path, 'Embeddings + mini-batch k-means': large_universe_path}
+        for backend, func in backends.items():
+            if backend == 'Average linkage' and n_tickers > linkage_max_tickers:
+                continue
+            labels, seconds, peak = _measure(func)
+            rows.append({
+                'Assets': n_tickers, 'Backend': backend, 'Seconds': seconds,
+                'Peak memory (MB)': peak, 'Adjusted Rand index': adjusted_rand_score(blocks, labels)
+            })
+    return pd.DataFrame(rows)
+
+
 def main():
     st.header("Portfolio Analysis: Reduce, Reuse, Recycle")
     st.write("""
@@ -23,8 +158,8 @@ def main():
             st.error("Portfolio data not found. Please go back to the 'Data Input' page and load your data first.")
             return
 
-        # Unpivot the tall dataframe to get log returns
-        logret = tall.reset_index().pivot(index='Date', columns='Ticker', values='logret')
+        # Wide log returns, pivoted once per tall dataframe
+        logret = get_panel(tall, 'logret')
 
         # Get unique sectors from the portfolio
         unique_sectors = sorted(ptf['Sector'].unique().tolist())
@@ -64,54 +199,53 @@ def main():
             st.warning("Please select at least one feature to cluster on.")
             return
 
-        # Calculate features for all assets
-        annualized_returns = logret_filtered.mean() * 252
-        annualized_volatility = logret_filtered.std() * np.sqrt(252)
-        features_df = pd.DataFrame({
-            'Annualized Return': annualized_returns,
-            'Annualized Volatility': annualized_volatility
-        })
+        # Calculate features for all assets, once per ticker selection
+        features_df = memoize(tall, ('cluster_features', tuple(filtered_tickers)),
+                              lambda: compute_features(logret_filtered))
 
         # --- 3. Perform Clustering based on Selection ---
         st.success(f"Data loaded for {len(logret_filtered.columns)} assets. Ready for clustering analysis.")
+        num_assets = len(logret_filtered.columns)
 
-        # Perform hierarchical clustering to get the linkage matrix
-        if cluster_on == ['Correlation']:
-            # Method 1: Cluster on correlation distance (as before)
-            corr_matrix = logret_filtered.corr()
-            distance_matrix = 1 - corr_matrix
-            corr_condensed = scipy.cluster.hierarchy.distance.squareform(distance_matrix)
-            z = scipy.cluster.hierarchy.linkage(corr_condensed, method='average')
+        backends = ['Hierarchical (average linkage)', 'Large universe (mini-batch k-means)']
+        backend = st.radio(
+            'Clustering backend:',
+            backends,
+            index=int(num_assets > LARGE_UNIVERSE_THRESHOLD),
+            horizontal=True,
+            help="Average linkage needs the full N x N distance matrix. The large-universe backend clusters "
+                 "low-dimensional return embeddings (or the standardized features) with mini-batch k-means instead."
+        )
+        large_universe = backend == backends[1]
+
+        if large_universe:
+            if cluster_on == ['Correlation']:
+                # Unit-length return embeddings stand in for the correlation distance
+                embedding = memoize(tall, ('return_embeddings', tuple(filtered_tickers)),
+                                    lambda: return_embeddings(logret_filtered))
+            else:
+                embedding = scale_features(features_df, cluster_on)
         else:
-            # Method 2: Cluster on a mix of features
-            # Use only the features selected by the user (excluding 'Correlation')
-            feature_list = [f for f in cluster_on if f != 'Correlation']
-            if not feature_list:
-                st.error("If not using 'Correlation', you must select 'Annualized Return' and/or 'Annualized Volatility'.")
-                return
-            
-            data_for_clustering = features_df[feature_list]
-            
-            # Standardize the features to give them equal weight
-            scaler = StandardScaler()
-            scaled_features = scaler.fit_transform(data_for_clustering)
-            
-            # Use euclidean distance for multi-feature clustering
-            z = scipy.cluster.hierarchy.linkage(scaled_features, method='average', metric='euclidean')
+            # Linkage matrix and every cut of the tree, cached so the slider below is a lookup
+            hierarchy = memoize(tall, ('hierarchy', tuple(filtered_tickers), tuple(cluster_on)),
+                                lambda: build_hierarchy(tall, filtered_tickers, features_df, cluster_on))
 
         # --- 4. Interactive Slider and Cluster Display ---
         st.subheader("Cluster Your Assets")
-        num_assets = len(logret_filtered.columns)
         
         n_clusters = st.slider(
             'Select the number of clusters:',
             min_value=1,
-            max_value=num_assets,
-            value=num_assets,
+            max_value=min(num_assets, 500) if large_universe else num_assets,
+            value=min(num_assets, 20) if large_universe else num_assets,
             step=1
         )
 
-        labels = scipy.cluster.hierarchy.fcluster(z, n_clusters, criterion='maxclust')
+        if large_universe:
+            labels = memoize(tall, ('kmeans_labels', tuple(filtered_tickers), tuple(cluster_on), n_clusters),
+                             lambda: kmeans_labels(embedding, n_clusters))
+        else:
+            labels = cut_labels(hierarchy, n_clusters)
         cluster_df = pd.DataFrame({'Ticker': logret_filtered.columns, 'Cluster': labels})
 
         # --- 5. Risk/Return Scatter Plot of Clusters ---
@@ -175,8 +309,14 @@ def main():
         # --- 6. Display Results and "Who Wins" Logic ---
         st.subheader(f"Asset Groups (for {n_clusters} clusters)")
 
-        for i in sorted(cluster_df['Cluster'].unique()):
-            cluster_tickers = cluster_df[cluster_df['Cluster'] == i]['Ticker'].tolist()
+        # Tickers of each cluster in one pass; beyond MAX_LISTED_CLUSTERS only the largest clusters are listed
+        cluster_members = cluster_df.groupby('Cluster')['Ticker'].agg(list)
+        if len(cluster_members) > MAX_LISTED_CLUSTERS:
+            st.info(f"Listing the {MAX_LISTED_CLUSTERS} largest of {len(cluster_members)} clusters.")
+            largest = cluster_members.str.len().sort_values(ascending=False, kind='stable').index[:MAX_LISTED_CLUSTERS]
+            cluster_members = cluster_members.loc[sorted(largest)]
+
+        for i, cluster_tickers in cluster_members.items():
             
             with st.expander(f"**Cluster {i}**: `{', '.join(cluster_tickers)}`"):
                 if len(cluster_tickers) > 1:
@@ -197,6 +337,11 @@ def main():
                 else:
                     st.write(f"This asset, **{cluster_tickers[0]}**, is in a cluster by itself, indicating it is distinct from other assets based on the selected features.")
 
+        with st.expander("Benchmark the clustering backends"):
+            if st.button("Run benchmark"):
+                with st.spinner("Clustering synthetic block-structured returns..."):
+                    st.dataframe(benchmark_clustering())
+
     except Exception as e:
         st.error(f"An error occurred: {e}")
 
@@ -4,9 +4,86 @@ import scipy
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
-import plotly.figure_factory as ff
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+from panel_store import get_panel, get_correlation, get_linkage, benchmark_correlation, memoize
+
+# Plotly's dendrogram colours for scipy's link colour codes
+DENDROGRAM_COLORS = {
+    'C0': 'rgb(0,116,217)', 'C1': 'rgb(61,153,112)', 'C2': 'rgb(255,65,54)', 'C3': 'rgb(35,205,205)',
+    'C4': 'rgb(133,20,75)', 'C5': 'rgb(255,220,0)', 'C6': 'rgb(40,35,35)', 'C7': 'rgb(61,153,112)',
+    'C8': 'rgb(255,65,54)', 'C9': 'rgb(35,205,205)'
+}
+
+# Above this many leaves the tickers are shown on hover instead of as axis labels
+MAX_LABELLED_LEAVES = 150
+
+
+def compute_dendrogram(z, labels, color_threshold=0.7):
+    """
+    Dendrogram of a linkage matrix (see panel_store.get_linkage) over the given labels.
+
+    Returns:
+        (leaves, links): leaves is a DataFrame with the Ticker, Y_Value and Color
+        of each leaf in dendrogram order; links holds scipy's icoord, dcoord and
+        color_list arrays for drawing the tree
+    """
+    tree = scipy.cluster.hierarchy.dendrogram(z, labels=list(labels), orientation='right',
+                                              color_threshold=color_threshold, no_plot=True)
+
+    # scipy places leaf i at 10 * i + 5
+    leaves = pd.DataFrame({
+        'Ticker': tree['ivl'],
+        'Y_Value': 10 * np.arange(len(tree['ivl'])) + 5,
+        'Color': [DENDROGRAM_COLORS.get(color, color) for color in tree['leaves_color_list']]
+    })
+    links = {
+        'icoord': np.asarray(tree['icoord']),
+        'dcoord': np.asarray(tree['dcoord']),
+        'color_list': np.asarray(tree['color_list'])
+    }
+    return leaves, links
+
+
+def dendrogram_traces(links):
+    """
+    One line trace per link colour, the links separated by gaps, drawn with
+    the leaves at x = 0 and the tree growing to the left.
+    """
+    traces = []
+    for color in pd.unique(links['color_list']):
+        selected = links['color_list'] == color
+        # Append a NaN column to every link so plotly breaks the line between them
+        gap = np.full((selected.sum(), 1), np.nan)
+        x = np.hstack([-links['dcoord'][selected], gap]).ravel()
+        y = np.hstack([links['icoord'][selected], gap]).ravel()
+        traces.append(go.Scatter(x=x, y=y, mode='lines', hoverinfo='skip',
+                                 line=dict(color=DENDROGRAM_COLORS.get(color, color), width=1)))
+    return traces
+
+
+def fig_dendrogram(leaves, links):
+    """Plotly dendrogram built from the scipy coordinates."""
+    fig = go.Figure(dendrogram_traces(links))
+    # Leaf markers carry the ticker on hover
+    fig.add_trace(go.Scatter(x=np.zeros(len(leaves)), y=leaves['Y_Value'], mode='markers',
+                             marker=dict(color=leaves['Color'], size=3), text=leaves['Ticker'], hoverinfo='text'))
+    fig.update_layout(showlegend=False, hovermode='closest', width=900, height=800,
+                      margin=dict(l=200, r=20, b=30, t=30), template='plotly_white')
+    fig.update_yaxes(leaf_axis(leaves))
+    fig.update_xaxes(showgrid=False, zeroline=False)
+    return fig
+
+
+def leaf_axis(leaves):
+    """Y axis showing the leaves in dendrogram order, top to bottom."""
+    axis = dict(autorange="reversed", showgrid=False, zeroline=False)
+    if len(leaves) <= MAX_LABELLED_LEAVES:
+        axis.update(tickmode='array', tickvals=leaves['Y_Value'], ticktext=leaves['Ticker'])
+    else:
+        axis.update(showticklabels=False)
+    return axis
+
  
 
 
@@ -30,8 +107,8 @@ def main():
     else:
         st.error("Tall dataframe not found in session state. Please return to previous step.")
 
-    # Unpivot the tall dataframe
-    logret = tall.reset_index().pivot(index='Date', columns='Ticker', values='logret')
+    # Wide log returns, pivoted once per tall dataframe
+    logret = get_panel(tall, 'logret')
 
     # Get unique sectors from the portfolio
     unique_sectors = sorted(ptf['Sector'].unique().tolist())
@@ -63,93 +140,59 @@ def main():
     # Use the filtered dataframe for further analysis
     logret = filtered_logret
 
-    # Calculate the correlation matrix from logret
-    corr_matrix = logret.drop('Portfolio', axis=1).corr()
+    # Slice the correlation matrix from the full-universe one, computed once per dataset
+    use_float32 = st.checkbox("Use float32 for the correlation matrix (faster on large universes)",
+                              value=len(logret.columns) > 1000)
+    dtype = np.float32 if use_float32 else np.float64
+    corr_matrix = get_correlation(tall, filtered_tickers, dtype=dtype)
     
     # Place the clustermap in an expander
     with st.expander("Seaborn Clustermap for reference", expanded=False):
-        st.write("Plotting the sns.clustermap of the correlation matrix...")
-        
-        sns.set_theme(font_scale=0.5)
-        fig, ax = plt.subplots(figsize=(20, 20))
-        cluster_grid = sns.clustermap(
-            corr_matrix,
-            annot=True,
-            cmap='coolwarm',
-            method='average',  # Linkage method: 'average', 'single', 'complete', 'weighted', etc.
-            metric='euclidean'  # Distance metric: 'euclidean', 'correlation', 'cosine', etc.
-        )
-        plt.close() # Close the figure as clustermap creates its own figure
-        st.pyplot(cluster_grid.figure)
+        # Seaborn redraws every cell, so only plot it on request
+        if st.checkbox("Plot the seaborn clustermap", value=len(corr_matrix) <= 100):
+            st.write("Plotting the sns.clustermap of the correlation matrix...")
+
+            sns.set_theme(font_scale=0.5)
+            cluster_grid = sns.clustermap(
+                corr_matrix,
+                annot=len(corr_matrix) <= 30,  # Cell labels are unreadable beyond a few dozen tickers
+                cmap='coolwarm',
+                method='average',  # Linkage method: 'average', 'single', 'complete', 'weighted', etc.
+                metric='euclidean',  # Distance metric: 'euclidean', 'correlation', 'cosine', etc.
+                figsize=(20, 20)
+            )
+            plt.close(cluster_grid.figure)
+            st.pyplot(cluster_grid.figure)
 
     # let's calculate a dendrogram of the correlation matrix
     st.write("Calculating the dendrogram of the correlation matrix...")
-    
-    # Create distance matrix from correlation matrix
-    corr_condensed = scipy.cluster.hierarchy.distance.squareform(1 - corr_matrix)
 
-    # Linkage methods: 'single', 'complete', 'average', 'weighted', 'centroid', 'median', 'ward'
-    # Distance metrics: 'euclidean', 'correlation', 'cosine', 'cityblock', 'braycurtis', etc.
-    z = scipy.cluster.hierarchy.linkage(corr_condensed, method='average', metric='euclidean')
-    
-    # Create dendrogram with plotly
-    fig_dendro = ff.create_dendrogram(
-        corr_matrix,
-        orientation='right',
-        labels=corr_matrix.columns,
-        linkagefun=lambda x: z,
-        color_threshold=0.7  # Adjust this threshold as needed
-    )
-    
-    # Update layout for better visibility
-    fig_dendro.update_layout(yaxis=dict(autorange="reversed"))
-    fig_dendro.update_layout(
-        width=900,
-        height=800,
-        margin=dict(l=200, r=20, b=30, t=30)
-    )
-    
-    # Display in Streamlit
-    st.plotly_chart(fig_dendro)
+    # Leaf order, colours and link coordinates straight from scipy, once per ticker selection and precision,
+    # on the average-linkage tree shared with the other clustering pages
+    leaves, links = memoize(tall, ('dendrogram', tuple(corr_matrix.columns), np.dtype(dtype).name),
+                            lambda: compute_dendrogram(get_linkage(tall, filtered_tickers, 'average', dtype),
+                                                       corr_matrix.columns))
+    if len(leaves) > MAX_LABELLED_LEAVES:
+        st.info(f"{len(leaves)} tickers: hover over the leaves to see the ticker names.")
 
-    # Extract Y positions and tickers from the dendrogram
-    y_labels = fig_dendro['layout']['yaxis']['ticktext']
-    y_values = fig_dendro['layout']['yaxis']['tickvals']
-    
-    # Initialize data for our dataframe
-    ticker_y_color_data = []
-    
-    # Extract colors for each ticker
-    for trace in fig_dendro['data']:
-        if 'marker' in trace and 'color' in trace['marker'] and 'x' in trace and 'y' in trace:
-            for i, x_val in enumerate(trace['x']):
-                if x_val == 0 or (i < len(trace['x'])-1 and trace['x'][i+1] == 0):
-                    y_val = trace['y'][i]
-                    if y_val in y_values:
-                        idx = y_values.index(y_val)
-                        ticker = y_labels[idx]
-                        color = trace['marker']['color']
-                        ticker_y_color_data.append({
-                            'Ticker': ticker,
-                            'Y_Value': y_val,
-                            'Color': color
-                        })
-    
-    # Create a dataframe with the collected data
-    ticker_colors_df = pd.DataFrame(ticker_y_color_data).sort_values('Y_Value').reset_index(drop=True)
+    fig_dendro = fig_dendrogram(leaves, links)
+    st.plotly_chart(fig_dendro)
 
-    # let's add  for each ticker to the dataframe
+    # Total return of each ticker, in dendrogram order
+    ticker_colors_df = leaves
     df_hbar = ticker_colors_df.copy()
-    df_hbar['Return'] = df_hbar['Ticker'].apply(lambda x: np.exp(logret[x].sum())-1)
-    df_hbar = df_hbar.sort_values('Y_Value').reset_index(drop=True)
+    df_hbar['Return'] = np.exp(logret[df_hbar['Ticker']].sum().to_numpy()) - 1
 
     # from ticker_colors_df create a plotly horizontal bar chart of the returns using the colors from the dendrogram
-    st.write("Creating a plotly horizontal bar chart of the returns using the colors from the dendrogram...")   
+    st.write("Creating a plotly horizontal bar chart of the returns using the colors from the dendrogram...")
     hbar_chart = go.Figure()
     hbar_chart.add_trace(go.Bar(
         x=df_hbar['Return'],
         y=df_hbar['Y_Value'],
         marker=dict(color=df_hbar['Color']),
+        text=df_hbar['Ticker'],
+        hovertemplate='%{text}: %{x:.1%}<extra></extra>',
+        textposition='none',
         orientation='h'
     ))
     hbar_chart.update_layout(
@@ -157,24 +200,23 @@ def main():
         xaxis_title='Return',
         yaxis_title='Ticker',
         # use the same y-axis labels as the dendrogram
-        yaxis=dict(
-            tickvals=y_values,
-            ticktext=y_labels,
-            autorange="reversed"
-        ),
+        yaxis=leaf_axis(leaves),
         width=900,
         height=800)
     st.plotly_chart(hbar_chart)
 
     # Sort the correlation matrix according to the dendrogram order
     sorted_tickers = ticker_colors_df['Ticker'].tolist()
-    sorted_corr = corr_matrix.loc[sorted_tickers, sorted_tickers]
+    positions = corr_matrix.index.get_indexer(sorted_tickers)
+    sorted_corr = corr_matrix.to_numpy()[np.ix_(positions, positions)].astype(np.float32)
 
     # Create heatmap
     heatmap_fig = go.Figure(data=go.Heatmap(
-        z=sorted_corr.values,
-        x=sorted_corr.columns,
-        y=sorted_corr.index,
+        z=sorted_corr,
+        x=sorted_tickers,
+        y=leaves['Y_Value'],
+        text=np.array(sorted_tickers),
+        hovertemplate='%{text} / %{x}: %{z:.2f}<extra></extra>',
         colorscale='RdBu_r',
         zmin=-1,
         zmax=1,
@@ -186,32 +228,18 @@ def main():
         title='Correlation Matrix Heatmap',
         width=900,
         height=800,
-        yaxis=dict(
-            tickvals=y_values,
-            ticktext=y_labels,
-            autorange="reversed"
-        ),
+        yaxis=leaf_axis(leaves),
         margin=dict(l=200, r=50, b=100, t=50),
     )
+    if len(leaves) > MAX_LABELLED_LEAVES:
+        heatmap_fig.update_xaxes(showticklabels=False)
 
     # Display in Streamlit
     st.plotly_chart(heatmap_fig)
 
     # Create a combined figure with dendrogram and heatmap side by side with synchronized y-axis
     st.subheader("Combined Dendrogram and Correlation Heatmap")
-    
-    # Get the ticker order and their exact y positions from the dendrogram
-    ticker_to_position = {}
-    for idx, (ticker, y_val) in enumerate(zip(y_labels, y_values)):
-        ticker_to_position[ticker] = y_val
-    
-    # Sort the correlation matrix according to the dendrogram order
-    sorted_tickers = ticker_colors_df['Ticker'].tolist()
-    sorted_corr = corr_matrix.loc[sorted_tickers, sorted_tickers]
-    
-    # Get the exact y positions for each ticker in the sorted order
-    sorted_y_positions = [ticker_to_position[ticker] for ticker in sorted_tickers]
-    
+
     # Create subplot figure
     combined_fig = make_subplots(
         rows=1, 
@@ -223,15 +251,17 @@ def main():
     )
     
     # Add dendrogram traces to the first subplot
-    for trace in fig_dendro['data']:
+    for trace in dendrogram_traces(links):
         combined_fig.add_trace(trace, row=1, col=1)
     
-    # Add heatmap to the second subplot - using exact dendrogram y positions
+    # Add heatmap to the second subplot - using the dendrogram leaf positions
     combined_fig.add_trace(
         go.Heatmap(
-            z=sorted_corr.values,
-            x=sorted_corr.columns,
-            y=sorted_y_positions,  # Use the exact y positions from the dendrogram
+            z=sorted_corr,
+            x=sorted_tickers,
+            y=leaves['Y_Value'],
+            text=np.array(sorted_tickers),
+            hovertemplate='%{text} / %{x}: %{z:.2f}<extra></extra>',
             colorscale='RdBu_r',
             zmin=-1,
             zmax=1,
@@ -241,13 +271,9 @@ def main():
     )
     
     # Set the y-axis properties for both subplots to use only ticker symbols
-    combined_fig.update_yaxes(
-        tickvals=sorted_y_positions,
-        ticktext=sorted_tickers,  # Use ticker symbols for dendrogram y-axis
-        autorange="reversed",
-        showticklabels=True,  # Show ticklabels on first subplot
-        row=1, col=1  # Apply to first subplot
-        )
+    combined_fig.update_yaxes(leaf_axis(leaves), row=1, col=1)
+    if len(leaves) > MAX_LABELLED_LEAVES:
+        combined_fig.update_xaxes(showticklabels=False, row=1, col=2)
     
     # Update layout
     combined_fig.update_layout(
@@ -261,5 +287,10 @@ def main():
     # Display the combined figure
     st.plotly_chart(combined_fig)
 
+    with st.expander("Benchmark the correlation engine"):
+        if st.button("Run benchmark"):
+            with st.spinner("Timing full builds, sector slices and incremental updates..."):
+                st.dataframe(benchmark_correlation())
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,12 +1,15 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from sklearn.decomposition import PCA
+import time
+import scipy.linalg
+from sklearn.decomposition import PCA, IncrementalPCA
 from sklearn.preprocessing import StandardScaler
 import seaborn as sns
 import matplotlib.pyplot as plt
 import plotly.graph_objects as go
 import plotly.express as px
+from panel_store import get_panel, memoize, rolling_covariance
 
 def load_and_prepare_data():
     """Loads and prepares data for PCA."""
@@ -15,34 +18,133 @@ def load_and_prepare_data():
         st.stop()
     
     tall = st.session_state.tall
-    logret = tall.reset_index().pivot(index='Date', columns='Ticker', values='logret')
+    logret = get_panel(tall, 'logret')
 
     if 'Portfolio' in logret.columns:
         logret = logret.drop(columns='Portfolio', axis=1)
     
     return logret
 
-def perform_pca(logret):
-    """Performs PCA on the log returns data."""
-    scaler = StandardScaler()
-    logret_scaled = scaler.fit_transform(logret.dropna())
-    
-    pca = PCA(n_components=logret.shape[1])
-    pca.fit(logret_scaled)
-    
-    factor_loadings = pd.DataFrame(
-        pca.components_.T,
-        index=logret.columns,
-        columns=[f"PC{i+1}" for i in range(pca.n_components_)]
-    )
-    
-    return pca, factor_loadings, logret_scaled
+PCA_SOLVERS = ['auto', 'full', 'randomized', 'incremental', 'covariance']
+
+# Fewest components to fit: the 3D loadings plot needs PC1 to PC4
+MIN_COMPONENTS = 4
+
+# Most components drawn in the time series trellis
+MAX_PLOTTED_COMPONENTS = 30
+
+def _fit_components(logret_scaled, n_components, solver, cov=None, chunk_size=500, random_state=0):
+    """
+    Top n_components principal components of the standardized returns with the given solver.
+    The 'covariance' solver takes the (tickers x tickers) covariance of logret_scaled as cov.
+
+    Returns:
+        (components, explained_variance_ratio) with components as (n_components x tickers)
+    """
+    n_dates, n_tickers = logret_scaled.shape
+    if solver == 'full':
+        pca = PCA(n_components=n_components, svd_solver='full').fit(logret_scaled)
+        return pca.components_, pca.explained_variance_ratio_
+    if solver == 'randomized':
+        pca = PCA(n_components=n_components, svd_solver='randomized', random_state=random_state).fit(logret_scaled)
+        return pca.components_, pca.explained_variance_ratio_
+    if solver == 'incremental':
+        # Partial fits over chunks of dates; each chunk needs at least n_components rows
+        pca = IncrementalPCA(n_components=n_components, batch_size=max(chunk_size, n_components))
+        pca.fit(logret_scaled)
+        return pca.components_, pca.explained_variance_ratio_
+    if solver == 'covariance':
+        # Eigenvectors of the (tickers x tickers) covariance: cheap when dates >> tickers
+        eigenvalues, eigenvectors = scipy.linalg.eigh(cov, subset_by_index=[n_tickers - n_components, n_tickers - 1])
+        eigenvalues, eigenvectors = eigenvalues[::-1], eigenvectors[:, ::-1].T
+        # Same sign convention as sklearn: the largest loading of each component is positive
+        signs = np.sign(eigenvectors[np.arange(n_components), np.abs(eigenvectors).argmax(axis=1)])
+        return eigenvectors * signs[:, None], eigenvalues / np.trace(cov)
+    raise ValueError(f"Unknown PCA solver '{solver}', expected one of {PCA_SOLVERS}")
+
+def choose_pca_solver(n_dates, n_tickers):
+    """Pick a PCA solver from the shape of the (dates x tickers) panel."""
+    if n_tickers <= 500:
+        return 'full'
+    if n_dates >= 2 * n_tickers and n_tickers <= 1000:
+        return 'covariance'
+    if n_dates > 10_000:
+        return 'incremental'
+    return 'randomized'
+
+def standardize_logret(logret):
+    """
+    Dates with a return for every ticker, and their returns standardized per ticker.
+
+    Returns:
+        (logret without missing dates, (dates x tickers) standardized array)
+    """
+    logret = logret.dropna()
+    return logret, StandardScaler().fit_transform(logret)
+
+def synthetic_factor_returns(n_dates, n_tickers, n_factors=20, seed=0):
+    """
+    Log returns driven by a few factors plus noise, as a (dates x tickers)
+    DataFrame. Shared by the benchmarks of the machine learning pages.
+    """
+    rng = np.random.default_rng(seed)
+    factors = rng.normal(0, 0.01, size=(n_dates, n_factors)) * np.linspace(2, 0.5, n_factors)
+    exposures = rng.normal(0, 1, size=(n_factors, n_tickers))
+    exposures[0] += 1  # The first factor is the market
+    values = factors @ exposures + rng.normal(0, 0.015, size=(n_dates, n_tickers))
+    dates = pd.bdate_range('2015-01-01', periods=n_dates, name='Date')
+    return pd.DataFrame(values, index=dates, columns=pd.Index([f"T{i:05d}" for i in range(n_tickers)], name='Ticker'))
+
+def perform_pca(logret, solver='auto', threshold=0.8):
+    """
+    Performs PCA on the log returns data.
+
+    The 'full' solver fits every component, as a plain PCA would. The other
+    solvers fit only the leading components, doubling their number until they
+    explain at least threshold of the variance.
 
-def plot_explained_variance(pca):
+    Args:
+        logret: Wide (dates x tickers) log returns
+        solver: 'full', 'randomized', 'incremental', 'covariance' or 'auto'
+        threshold: Share of variance the fitted components must explain
+
+    Returns:
+        dict with the solver used, the explained variance ratio, the factor
+        loadings (tickers x components) and the PC time series (dates x components)
+    """
+    logret, logret_scaled = standardize_logret(logret)
+    n_dates, n_tickers = logret_scaled.shape
+    max_components = min(n_dates, n_tickers)
+
+    if solver == 'auto':
+        solver = choose_pca_solver(n_dates, n_tickers)
+
+    # The covariance is shared by every fit of the eigen solver
+    cov = logret_scaled.T @ logret_scaled / (n_dates - 1) if solver == 'covariance' else None
+
+    n_components = max_components if solver == 'full' else min(max(MIN_COMPONENTS, 32), max_components)
+    while True:
+        components, explained_variance_ratio = _fit_components(logret_scaled, n_components, solver, cov=cov)
+        if n_components == max_components or explained_variance_ratio.sum() >= threshold:
+            break
+        n_components = min(2 * n_components, max_components)
+
+    columns = [f"PC{i+1}" for i in range(n_components)]
+    factor_loadings = pd.DataFrame(components.T, index=logret.columns, columns=columns)
+    pc_time_series = pd.DataFrame(logret_scaled @ components.T, index=logret.index, columns=columns)
+
+    return {
+        'solver': solver,
+        'explained_variance_ratio': explained_variance_ratio,
+        'factor_loadings': factor_loadings,
+        'pc_time_series': pc_time_series
+    }
+
+def plot_explained_variance(explained_variance_ratio):
     """Plots the explained variance and cumulative explained variance."""
     explained_variance = pd.DataFrame(
-        pca.explained_variance_ratio_,
-        index=[f"PC{i+1}" for i in range(pca.n_components_)],
+        explained_variance_ratio,
+        index=[f"PC{i+1}" for i in range(len(explained_variance_ratio))],
         columns=["Explained Variance"]
     )
     explained_variance['Cumulative Explained Variance'] = explained_variance['Explained Variance'].cumsum()
@@ -180,17 +282,13 @@ def plot_3d_factor_loadings(factor_loadings):
     # Display the plot
     st.plotly_chart(fig, use_container_width=True)
 
-def plot_pc_time_series(pca, logret_scaled, logret, num_components):
+def plot_pc_time_series(pc_ts_df, num_components):
     """Plots the time series of principal components."""
     st.subheader("Time Series of Principal Components")
 
-    # Calculate the time series of the principal components
-    pc_time_series = pca.transform(logret_scaled)
-    pc_ts_df = pd.DataFrame(
-        pc_time_series,
-        index=logret.dropna().index,
-        columns=[f"PC{i+1}" for i in range(pca.n_components_)]
-    )
+    if num_components > MAX_PLOTTED_COMPONENTS:
+        st.info(f"Showing the first {MAX_PLOTTED_COMPONENTS} of the {num_components} selected components.")
+        num_components = MAX_PLOTTED_COMPONENTS
 
     if num_components > 0:
         selected_pcs = [f"PC{i+1}" for i in range(num_components)]
@@ -235,6 +333,165 @@ def plot_pc_time_series(pca, logret_scaled, logret, num_components):
 
 
 
+def _top_eigenvectors(corr, n_components):
+    """Leading eigenvalues (descending) and eigenvectors (n_components x tickers) of a symmetric matrix."""
+    n = len(corr)
+    eigenvalues, eigenvectors = scipy.linalg.eigh(corr, subset_by_index=[n - n_components, n - 1])
+    return eigenvalues[::-1], eigenvectors[:, ::-1].T
+
+def _warm_start_eigenvectors(corr, previous, n_iter=2):
+    """
+    Refine the previous window's eigenvectors for the new matrix by subspace
+    iteration followed by a Rayleigh-Ritz rotation.
+
+    Returns:
+        (eigenvalues, eigenvectors) with eigenvectors as rows, largest first
+    """
+    basis = previous.T
+    for _ in range(n_iter):
+        basis, _ = np.linalg.qr(corr @ basis)
+    eigenvalues, rotation = np.linalg.eigh(basis.T @ corr @ basis)
+    order = np.argsort(eigenvalues)[::-1]
+    return eigenvalues[order], (basis @ rotation[:, order]).T
+
+def rolling_pca(logret, window=252, step=5, n_components=3, oversample=5, n_iter=2, warm_start=True):
+    """
+    PCA of the standardized log returns on a rolling window.
+
+    The window covariance is updated with the rows entering and leaving it,
+    and the eigenvectors of each window are refined from those of the previous
+    window rather than decomposed from scratch. A few extra components
+    (oversample) are tracked to keep the leading ones converging. Each
+    component's sign is chosen to agree with the previous window.
+
+    Args:
+        logret: Wide (dates x tickers) log returns; missing returns count as zero
+        window: Dates per window
+        step: Dates between window ends
+        n_components: Components to keep
+        warm_start: False decomposes every window from scratch (for comparison)
+
+    Returns:
+        dict with 'dates' (window ends), 'tickers', 'explained_variance_ratio'
+        (windows x components) and 'loadings' (windows x components x tickers, float32)
+    """
+    values = logret.to_numpy(dtype=float)
+    n_tickers = values.shape[1]
+    n_components = min(n_components, n_tickers)
+    n_tracked = min(n_components + oversample, n_tickers)
+
+    ends, ratios, loadings = [], [], []
+    previous = None
+    for end, cov in rolling_covariance(values, window, step):
+        # Correlation matrix; tickers without variance in the window drop out
+        std = np.sqrt(np.clip(np.diag(cov), 0, None))
+        scale = np.divide(1.0, std, out=np.zeros_like(std), where=std > 0)
+        corr = cov * np.outer(scale, scale)
+
+        if previous is None or not warm_start:
+            eigenvalues, eigenvectors = _top_eigenvectors(corr, n_tracked)
+        else:
+            eigenvalues, eigenvectors = _warm_start_eigenvectors(corr, previous, n_iter)
+
+        # Align signs with the previous window, or make the largest loading positive for the first one
+        if previous is None:
+            signs = np.sign(eigenvectors[np.arange(n_tracked), np.abs(eigenvectors).argmax(axis=1)])
+        else:
+            signs = np.sign(np.einsum('ij,ij->i', eigenvectors, previous))
+        eigenvectors = eigenvectors * np.where(signs == 0, 1, signs)[:, None]
+        previous = eigenvectors
+
+        ends.append(end)
+        ratios.append(eigenvalues[:n_components] / max(np.trace(corr), 1e-12))
+        loadings.append(eigenvectors[:n_components].astype(np.float32))
+
+    return {
+        'dates': logret.index[ends],
+        'tickers': logret.columns,
+        'explained_variance_ratio': np.array(ratios).reshape(len(ends), n_components),
+        'loadings': np.array(loadings, dtype=np.float32).reshape(len(ends), n_components, n_tickers)
+    }
+
+def plot_rolling_pca(rolling):
+    """Rolling explained variance of the leading components, and the loadings of one ticker over time."""
+    st.subheader("Rolling PCA")
+    n_components = rolling['loadings'].shape[1]
+    columns = [f"PC{i+1}" for i in range(n_components)]
+
+    evr = pd.DataFrame(rolling['explained_variance_ratio'], index=rolling['dates'], columns=columns)
+    fig_evr = px.line(evr, title="Rolling Explained Variance Ratio")
+    fig_evr.update_layout(yaxis_tickformat=".0%", yaxis_title=None, xaxis_title=None, legend_title=None)
+    st.plotly_chart(fig_evr, use_container_width=True)
+
+    ticker = st.selectbox("Loadings of ticker", rolling['tickers'], key="rolling_pca_ticker")
+    position = rolling['tickers'].get_loc(ticker)
+    ticker_loadings = pd.DataFrame(rolling['loadings'][:, :, position], index=rolling['dates'], columns=columns)
+    fig_loadings = px.line(ticker_loadings, title=f"Rolling Loadings of {ticker}")
+    fig_loadings.add_hline(y=0, line=dict(color='#A9A9A9', dash='dash'))
+    fig_loadings.update_layout(yaxis_title=None, xaxis_title=None, legend_title=None)
+    st.plotly_chart(fig_loadings, use_container_width=True)
+
+    # PC1 loadings of every ticker over time
+    pc1 = pd.DataFrame(rolling['loadings'][:, 0, :].T, index=rolling['tickers'], columns=rolling['dates'])
+    fig_heatmap = go.Figure(go.Heatmap(z=pc1.to_numpy(), x=pc1.columns, y=pc1.index, colorscale='RdBu_r', zmid=0))
+    fig_heatmap.update_layout(title="PC1 Loadings over Time", height=max(400, min(12 * len(pc1), 1200)))
+    st.plotly_chart(fig_heatmap, use_container_width=True)
+
+def benchmark_pca(shapes=((2520, 500), (2520, 2000), (750, 3000)), full_max_tickers=2000):
+    """
+    Time every PCA solver on synthetic factor returns and compare the explained
+    variance of the first five components with the full SVD.
+
+    Returns:
+        DataFrame with one row per shape and solver
+    """
+    rows = []
+    for n_dates, n_tickers in shapes:
+        logret = synthetic_factor_returns(n_dates, n_tickers)
+        reference = None
+        for solver in ['full', 'randomized', 'incremental', 'covariance']:
+            if solver == 'full' and n_tickers > full_max_tickers:
+                continue
+            start = time.perf_counter()
+            results = perform_pca(logret, solver)
+            seconds = time.perf_counter() - start
+            ratio = results['explained_variance_ratio']
+            if solver == 'full':
+                reference = ratio
+            row = {
+                'Dates': n_dates, 'Tickers': n_tickers, 'Solver': solver, 'Seconds': seconds,
+                'Components fitted': len(ratio),
+                'PCs for 80%': int(np.searchsorted(np.cumsum(ratio), 0.8) + 1)
+            }
+            if reference is not None:
+                row['Max diff EVR PC1-5'] = np.abs(ratio[:5] - reference[:5]).max()
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def benchmark_rolling_pca(n_dates=2520, n_tickers=500, window=252, step=5):
+    """
+    Time rolling PCA with warm-started eigenvectors against decomposing every
+    window from scratch, and report how far apart the results are.
+    """
+    logret = synthetic_factor_returns(n_dates, n_tickers)
+    results, seconds = {}, {}
+    for warm_start in (True, False):
+        start = time.perf_counter()
+        results[warm_start] = rolling_pca(logret, window, step, warm_start=warm_start)
+        seconds[warm_start] = time.perf_counter() - start
+
+    warm, cold = results[True], results[False]
+    cosines = np.abs(np.einsum('wkn,wkn->wk', warm['loadings'].astype(float), cold['loadings'].astype(float)))
+    return pd.DataFrame({
+        'Windows': [len(warm['dates'])],
+        'Warm start seconds': [seconds[True]],
+        'From scratch seconds': [seconds[False]],
+        'Max diff EVR': [np.abs(warm['explained_variance_ratio'] - cold['explained_variance_ratio']).max()],
+        'Min |cos| PC1-3': [cosines.min()]
+    })
+
+
 def main():
     st.title("PCA Analysis")
     st.info("""
@@ -247,18 +504,54 @@ def main():
     Next a 3D scatter plot is generated of the first three principal 
     components PC1 - PC3, colored by PC4.
             
-    Finally, the time series of the principal components is plotted,
+    Then the time series of the principal components is plotted,
     showing the cumulative performance of the selected components.
+
+    Finally, a rolling PCA shows how the explained variance of PC1 - PC3
+    and the loadings change over time.
     """)
 
     logret = load_and_prepare_data()
-    
-    pca, factor_loadings, logret_scaled = perform_pca(logret)
 
-    num_components_for_80_var, explained_variance_df = plot_explained_variance(pca)
+    solver = st.selectbox(
+        "PCA solver",
+        PCA_SOLVERS,
+        help="'auto' picks full SVD for up to 500 tickers, the covariance eigen-decomposition for up to 1000 "
+             "tickers with at least twice as many dates, incremental PCA beyond 10,000 dates and randomized SVD otherwise."
+    )
+
+    # Fit once per dataset and solver; the sections below only read the result
+    with st.spinner("Fitting PCA..."):
+        results = memoize(st.session_state.tall, ('pca', solver), lambda: perform_pca(logret, solver))
+    factor_loadings = results['factor_loadings']
+    st.caption(f"Solver: {results['solver']}, {factor_loadings.shape[1]} components fitted for {factor_loadings.shape[0]} tickers.")
+
+    num_components_for_80_var, explained_variance_df = plot_explained_variance(results['explained_variance_ratio'])
 
     num_components_from_clustermap = plot_factor_loadings_clustermap(factor_loadings, num_components_for_80_var, explained_variance_df)
 
     plot_3d_factor_loadings(factor_loadings)
 
-    plot_pc_time_series(pca, logret_scaled, logret, num_components_from_clustermap)
+    plot_pc_time_series(results['pc_time_series'], num_components_from_clustermap)
+
+    # Windows run from 63 days in steps of 21, up to two years or the longest the history allows
+    max_window = min(504, 63 + 21 * ((len(logret) - 1 - 63) // 21))
+    if max_window >= 63:
+        col1, col2 = st.columns(2)
+        window = col1.slider("Rolling window (days)", min_value=63, max_value=max_window, value=min(252, max_window),
+                             step=21, disabled=max_window == 63)
+        step = col2.slider("Days between windows", min_value=1, max_value=21, value=5)
+        with st.spinner("Tracking the principal components over time..."):
+            rolling = memoize(st.session_state.tall, ('rolling_pca', window, step),
+                              lambda: rolling_pca(logret, window=window, step=step))
+        plot_rolling_pca(rolling)
+    else:
+        st.info("Rolling PCA needs more than 63 days of returns.")
+
+    with st.expander("Benchmark the PCA solvers"):
+        if st.button("Run benchmark"):
+            with st.spinner("Fitting every solver on synthetic factor returns..."):
+                st.dataframe(benchmark_pca())
+        if st.button("Run rolling PCA benchmark"):
+            with st.spinner("Comparing warm-started and from-scratch rolling PCA..."):
+                st.dataframe(benchmark_rolling_pca())
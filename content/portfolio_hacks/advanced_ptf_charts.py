@@ -4,9 +4,106 @@ import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
 from plotly.subplots import make_subplots
+from panel_store import get_panel, memoize
 
 
-def create_stock_comparison_figure(tall, ptf, ticker):
+def compute_comparison_stats(tall):
+    """
+    Per-ticker statistics used by the comparison figure, for every ticker at once.
+
+    Parameters:
+    -----------
+    tall : DataFrame
+        Time series data for all tickers including portfolio
+
+    Returns:
+    --------
+    dict
+        'tickers' (the portfolio included) and arrays aligned with them:
+        'vol' (annualized), 'tr' (from summed log returns), 'last_cumret',
+        'corr' with the portfolio and 'final_weight' in the portfolio;
+        the portfolio's own 'ptf_vol', 'ptf_tr', 'ptf_last_cumret'; and the
+        global axis ranges 'xs_range' and 'cumret_range'
+    """
+    logret = get_panel(tall, 'logret')
+    cumret = get_panel(tall, 'cumret')
+    value = get_panel(tall, 'value')
+
+    y = logret.to_numpy(dtype=float)
+    x = logret['Portfolio'].to_numpy(dtype=float)
+    vol = np.nanstd(y, axis=0, ddof=1) * (252 ** 0.5)
+    tr = np.exp(np.nansum(y, axis=0)) - 1
+
+    # Correlation of every ticker with the portfolio over the dates both have
+    mask = np.isfinite(y) & np.isfinite(x)[:, None]
+    n = mask.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_mean = np.where(mask, x[:, None], 0).sum(axis=0) / n
+        y_mean = np.where(mask, y, 0).sum(axis=0) / n
+        dx = np.where(mask, x[:, None] - x_mean, 0)
+        dy = np.where(mask, y - y_mean, 0)
+        corr = (dx * dy).sum(axis=0) / np.sqrt((dx * dx).sum(axis=0) * (dy * dy).sum(axis=0))
+        final_weight = value.iloc[-1].to_numpy(dtype=float) / value['Portfolio'].iloc[-1]
+
+    excess_returns = cumret.sub(cumret['Portfolio'], axis=0).drop('Portfolio', axis=1)
+    cumret_values = tall['cumret']
+
+    ptf = logret.columns.get_loc('Portfolio')
+    return {
+        'tickers': logret.columns,
+        'vol': vol, 'tr': tr, 'corr': corr, 'final_weight': final_weight,
+        'last_cumret': cumret.iloc[-1].to_numpy(dtype=float),
+        'ptf_vol': vol[ptf], 'ptf_tr': tr[ptf], 'ptf_last_cumret': cumret['Portfolio'].iloc[-1],
+        'xs_range': [excess_returns.min().min(), excess_returns.max().max()],
+        'cumret_range': [cumret_values.min(), cumret_values.max()]
+    }
+
+
+def compute_frontiers(stats, n_points=30):
+    """
+    Two-asset frontiers (ticker vs portfolio) of every ticker as (tickers x points) arrays.
+
+    The ticker weight runs from the short position that cancels its weight in
+    the portfolio up to 100%, with zero always included. Variance of the mix:
+    w_t^2 s_t^2 + w_p^2 s_p^2 + 2 w_t w_p corr s_t s_p.
+
+    Returns:
+    --------
+    dict
+        'w_ticker', 'v_p' and 'r_p' float32 arrays of shape (tickers x n_points + 1)
+        and 'zero_exposure', the point where the total ticker exposure is closest to zero
+    """
+    final_weight = stats['final_weight'][:, None]
+    v_ticker, v_portfolio = stats['vol'][:, None], stats['ptf_vol']
+    steps = np.linspace(0, 1, n_points)
+
+    # The portfolio's own frontier is undefined (it would need an infinite short) and stays NaN
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # how much of ticker do i need to go short to get the portfolio performance without the ticker?
+        short_ticker_weight = final_weight / (1 - final_weight)
+        w_ticker = -short_ticker_weight + (1 + short_ticker_weight) * steps
+        w_ticker = np.sort(np.hstack([w_ticker, np.zeros_like(final_weight)]), axis=1)
+        w_portfolio = 1 - w_ticker
+
+        variance = (w_ticker ** 2 * v_ticker ** 2 + w_portfolio ** 2 * v_portfolio ** 2
+                    + 2 * w_ticker * w_portfolio * stats['corr'][:, None] * v_ticker * v_portfolio)
+        v_p = np.sqrt(np.clip(variance, 0, None))
+        r_p = w_ticker * stats['last_cumret'][:, None] + w_portfolio * stats['ptf_last_cumret']
+
+        # Allocation to ticker in the portfolio
+        w_ticker_in_ptf = w_ticker + w_portfolio * final_weight
+    zero_exposure = np.nanargmin(np.where(np.isfinite(w_ticker_in_ptf), np.abs(w_ticker_in_ptf), np.inf), axis=1)
+
+    return {
+        'w_ticker': w_ticker.astype(np.float32),
+        'v_p': v_p.astype(np.float32),
+        'r_p': r_p.astype(np.float32),
+        'zero_exposure': zero_exposure
+    }
+
+
+
+def create_stock_comparison_figure(tall, ptf, ticker, n_points=30):
     """
     Create a figure comparing a specific ticker to the portfolio benchmark.
     
@@ -18,31 +115,34 @@ def create_stock_comparison_figure(tall, ptf, ticker):
         Portfolio configuration dataframe
     ticker : str
         Ticker symbol to analyze
+    n_points : int
+        Number of points on the efficient frontier
         
     Returns:
     --------
     plotly.graph_objects.Figure
         The complete comparison figure with multiple subplots
     """
-    # Extract the required data
-    tall_ptf = tall.loc['Portfolio']
-    tall_ticker = tall.loc[ticker]
-    
+    # Statistics of every ticker and the frontiers, computed once per dataset and resolution
+    stats = memoize(tall, 'comparison_stats', lambda: compute_comparison_stats(tall))
+    frontiers = memoize(tall, ('frontiers', n_points), lambda: compute_frontiers(stats, n_points))
+    i = stats['tickers'].get_loc(ticker)
+
     # Get ticker information
     ptf_ticker = ptf.set_index('Ticker').loc[ticker]
     ticker_name = ptf_ticker['Name']
     ticker_sector = ptf_ticker['Sector']
-    
-    # Calculate key metrics
-    ticker_tr = tall_ticker['cumret'].iloc[-1]
-    ticker_vol = tall_ticker['logret'].std() * (252 ** 0.5)
-    
-    ptf_tr = tall_ptf['cumret'].iloc[-1]
-    ptf_vol = tall_ptf['logret'].std() * (252 ** 0.5)
 
-    # Calculate outperformance (ticker cumret - portfolio cumret)
-    ticker_cumret = tall_ticker['cumret']
-    ptf_cumret = tall_ptf['cumret']
+    # Key metrics
+    ticker_tr = stats['last_cumret'][i]
+    ticker_vol = stats['vol'][i]
+    ptf_tr = stats['ptf_last_cumret']
+    ptf_vol = stats['ptf_vol']
+
+    # Cumulative returns of the ticker and the portfolio
+    cumret = get_panel(tall, 'cumret')
+    ticker_cumret = cumret[ticker]
+    ptf_cumret = cumret['Portfolio']
 
     # Calculate outperformance
     outperformance = ticker_cumret - ptf_cumret
@@ -50,52 +150,14 @@ def create_stock_comparison_figure(tall, ptf, ticker):
     # Calculate excess return
     excess_return = ticker_tr - ptf_tr
 
-    # Find the minimum and maximum excess returns to fix the plot range
-    cumret = tall['cumret'].reset_index().pivot(index='Date', columns='Ticker', values='cumret')   
-    excess_returns = cumret.sub(cumret['Portfolio'], axis=0).drop('Portfolio', axis=1)
-
-    logret = tall['logret'].reset_index().pivot(index='Date', columns='Ticker', values='logret')
-    vol = logret.std() * (252 ** 0.5)
-
-    # let's calculate the total return from the log returns for all tickers
-    tr = np.exp(logret.sum())-1
+    # Volatility and total return of all other tickers for the scatter plot
+    others = ~stats['tickers'].isin([ticker, 'Portfolio'])
     
-    # Calculate the correlation between ticker and portfolio
-    corr = logret[ticker].corr(logret['Portfolio'])
-
-    # Calculate the final weight of the ticker in the portfolio
-    ticker_in_ptf_final_weight = tall_ticker.iloc[-1]['value']/tall_ptf.iloc[-1]['value']
-    # how much of ticker do i need to go short to get the portfolio performance without the ticker?
-    short_ticker_weight = ticker_in_ptf_final_weight/(1 - ticker_in_ptf_final_weight)
-    
-    # Calculate efficient frontier points for different weight combinations
-    # Extend range to include negative weights (short positions) and ensure zero weight is included
-    weights = np.linspace(-short_ticker_weight, 1, 30)
-    if 0 not in weights:
-        weights = np.sort(np.append(weights, 0))
-    ef = pd.DataFrame(weights, columns=['w_ticker'])
-
-    ef['w_portfolio'] = 1 - ef['w_ticker']
-    ef['v_ticker'] = ticker_vol
-    ef['v_portfolio'] = ptf_vol
-    # let's add a column that shows the allocation to ticker in the portfolio
-    ef['w_ticker_in_ptf'] = ef['w_ticker'] + ef['w_portfolio'] * ticker_in_ptf_final_weight
-    
-    # Calculate portfolio variance and resulting risk/return for each weight combination
-    # Portfolio variance = w1σ1^2 + w2σ2^2 + 2w1w2Cov
-    # Cov = p(1,2)σ1σ2, where p(1,2)=correlation
-    ef['v_p'] = np.sqrt(
-        ef.w_ticker * ef.v_ticker ** 2 + 
-        ef.w_portfolio * ef.v_portfolio ** 2 + 
-        2 * ef.w_ticker * ef.w_portfolio * corr * ef.v_ticker * ef.v_portfolio
-    )
-
-    # Calculate expected return for each weight combination
-    ef['r_p'] = ef.w_ticker * ticker_tr + ef.w_portfolio * ptf_tr
-    
-    # Find the point where total weight in ticker is zero
-    zero_exposure_idx = np.abs(ef['w_ticker_in_ptf']).idxmin()
-    zero_exposure_point = ef.iloc[zero_exposure_idx]
+    # Efficient frontier of the ticker and the point where its total weight is zero
+    ef_w_ticker = frontiers['w_ticker'][i]
+    ef_v_p = frontiers['v_p'][i]
+    ef_r_p = frontiers['r_p'][i]
+    zero_exposure_idx = frontiers['zero_exposure'][i]
 
     # Create a color scheme for the plot
     ticker_color = '#1f77b4'  # Color for selected ticker
@@ -133,14 +195,14 @@ def create_stock_comparison_figure(tall, ptf, ticker):
      
     # Cumulative Returns - Add portfolio benchmark line
     fig.add_trace(
-        go.Scatter(x=tall_ptf['cumret'].index, y=tall_ptf['cumret'], 
+        go.Scatter(x=ptf_cumret.index, y=ptf_cumret, 
                   mode='lines', name='Portfolio', line=dict(color=ptf_color)),
         row=2, col=1
     )
    
     # Cumulative Returns - Add ticker line
     fig.add_trace(
-        go.Scatter(x=tall_ticker['cumret'].index, y=tall_ticker['cumret'], 
+        go.Scatter(x=ticker_cumret.index, y=ticker_cumret, 
                   mode='lines', name=ticker_name, line=dict(color=ticker_color)),
         row=2, col=1
     )
@@ -158,12 +220,12 @@ def create_stock_comparison_figure(tall, ptf, ticker):
 
     # Risk-Return Scatterplot - Add all tickers
     fig.add_trace(
-        go.Scatter(x=vol.drop([ticker, 'Portfolio']), 
-                  y=tr.drop([ticker, 'Portfolio']), 
+        go.Scatter(x=stats['vol'][others], 
+                  y=stats['tr'][others], 
                   mode='markers', 
                   name='',
                   marker=dict(color=ptf_color, size=8, opacity=0.4),
-                  text=vol.drop([ticker, 'Portfolio']).index,
+                  text=stats['tickers'][others],
                   hovertemplate='%{text}<br>Vol: %{x:.1%}<br>Return: %{y:.1%}'),
         row=2, col=3
     )
@@ -175,21 +237,21 @@ def create_stock_comparison_figure(tall, ptf, ticker):
     
     # Add efficient frontier line showing different weight combinations
     fig.add_trace(
-        go.Scatter(x=ef['v_p'],
-                  y=ef['r_p'],
+        go.Scatter(x=ef_v_p,
+                  y=ef_r_p,
                   mode='lines',
                   name='Efficient Frontier',
                   line=dict(color=ticker_color, dash='dot', width=1),
                   hovertemplate='Risk: %{x:.1%}<br>Return: %{y:.1%}<br>Weight: %{customdata:.1%}<extra></extra>',
-                  customdata=ef['w_ticker']),
+                  customdata=ef_w_ticker),
         row=2, col=3
     )
 
     # Add a simple vertical line marker at the point of zero exposure
     fig.add_trace(
         go.Scatter(
-            x=[zero_exposure_point['v_p']],
-            y=[zero_exposure_point['r_p']],
+            x=[ef_v_p[zero_exposure_idx]],
+            y=[ef_r_p[zero_exposure_idx]],
             mode='markers',
             marker=dict(
                 symbol='line-ns',
@@ -199,7 +261,7 @@ def create_stock_comparison_figure(tall, ptf, ticker):
             name='Zero Exposure',
             showlegend=False,
             hoverinfo='text',
-            hovertext=f"Zero Exposure: {zero_exposure_point['v_p']:.1%}"
+            hovertext=f"Zero Exposure: {ef_v_p[zero_exposure_idx]:.1%}"
         ),
         row=2, col=3
     )
@@ -222,15 +284,15 @@ def create_stock_comparison_figure(tall, ptf, ticker):
     # Update x-axis and y-axis properties
     fig.update_xaxes(autorange='reversed', row=2, col=3, rangemode='tozero', tickformat=".1%")
     fig.update_yaxes(row=1, col=1, tickformat=".1%", title="XS Returns", 
-                     range=[excess_returns.min().min(), excess_returns.max().max()])
+                     range=stats['xs_range'])
     fig.update_yaxes(row=2, col=1, tickformat=".1%", title="Cumulative Returns", 
-                     range=[tall['cumret'].min(), tall['cumret'].max()])
+                     range=stats['cumret_range'])
     fig.update_yaxes(row=2, col=2, tickformat=".1%")
     fig.update_yaxes(row=2, col=3, tickformat=".1%")
     fig.update_xaxes(row=2, col=3, tickformat=".1%", title="Volatility")
     
     # Get the max date and find last year's date
-    year_end_dt = pd.Timestamp(year=tall_ticker.index.max().year-1, month=12, day=31)
+    year_end_dt = pd.Timestamp(year=ticker_cumret.index.max().year-1, month=12, day=31)
     # draw a vline at the last date of the previous year
     fig.add_vline(x=year_end_dt, line=dict(color=ptf_color, width=0.75), row=2, col=1)
 
@@ -282,10 +344,11 @@ def main():
     # Create a dropdown to select the ticker from the filtered list in the second column
     with col2:
         ticker = st.selectbox("Select a ticker", available_tickers)
-    
+
+    n_points = st.select_slider("Efficient frontier resolution (points)", options=[30, 100, 300, 1000, 3000], value=30)
 
     # Create the comparison figure using the dedicated function with simplified parameters
-    fig = create_stock_comparison_figure(tall, ptf, ticker)
+    fig = create_stock_comparison_figure(tall, ptf, ticker, n_points=n_points)
     
     st.plotly_chart(fig, use_container_width=True)
 
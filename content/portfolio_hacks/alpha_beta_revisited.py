@@ -5,10 +5,52 @@ import pandas as pd
 import numpy as np
 from plotly.subplots import make_subplots
 import statsmodels.api as sm
+import time
+from scipy import stats
+from panel_store import get_panel, memoize
+
+def batched_regression(y, x):
+    """
+    Regress every column of y on x at once: y[:, i] = alpha_i + beta_i * x.
+
+    Args:
+        y: (dates x tickers) array of returns
+        x: (dates,) array of benchmark returns
+
+    Observations where either series is NaN or infinite are masked out per
+    ticker, as the per-ticker dropna() did before.
+
+    Returns:
+        dict of per-ticker arrays: n, alpha (per day), beta, r_squared, f_pvalue
+    """
+    mask = np.isfinite(y) & np.isfinite(x)[:, None]
+    n = mask.sum(axis=0)
+    x_masked = np.where(mask, x[:, None], 0.0)
+    y_masked = np.where(mask, y, 0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Centre on the per-ticker means of the valid observations
+        x_mean = x_masked.sum(axis=0) / n
+        y_mean = y_masked.sum(axis=0) / n
+        dx = np.where(mask, x_masked - x_mean, 0.0)
+        dy = np.where(mask, y_masked - y_mean, 0.0)
+        sxx = np.einsum('ij,ij->j', dx, dx)
+        sxy = np.einsum('ij,ij->j', dx, dy)
+        syy = np.einsum('ij,ij->j', dy, dy)
+
+        beta = sxy / sxx
+        alpha = y_mean - beta * x_mean
+        r_squared = sxy ** 2 / (sxx * syy)
+        # F-test of the slope with (1, n - 2) degrees of freedom
+        f_stat = r_squared / (1 - r_squared) * (n - 2)
+    f_pvalue = stats.f.sf(f_stat, 1, n - 2)
+
+    return {'n': n, 'alpha': alpha, 'beta': beta, 'r_squared': r_squared, 'f_pvalue': f_pvalue}
 
 def calculate_regression_metrics(tall):
     """
     Calculate regression metrics for each ticker against portfolio returns.
+    All tickers are estimated together on the (dates x tickers) log-return matrix.
     
     Args:
         tall: Multi-index DataFrame containing ticker data with 'logret' and 'cumret'
@@ -16,112 +58,240 @@ def calculate_regression_metrics(tall):
     Returns:
         DataFrame containing regression metrics and performance attribution
     """
-    # Get unique tickers excluding the portfolio
+    # Wide (dates x tickers) panels
+    logret = get_panel(tall, 'logret')
+    cumret = get_panel(tall, 'cumret')
+    portfolio_returns = logret['Portfolio']
+
+    # Tickers in index order, excluding the portfolio
     tickers = [ticker for ticker in tall.index.levels[0].unique() if ticker != 'Portfolio']
-    portfolio_returns = tall.loc['Portfolio']['logret']
-    
-    # Initialize results DataFrame
-    results = []
+    fit = batched_regression(logret[tickers].to_numpy(dtype=float), portfolio_returns.to_numpy(dtype=float))
+
+    # Skip tickers without enough data (or with a flat benchmark over their dates)
+    valid = (fit['n'] > 2) & np.isfinite(fit['beta'])
+
+    beta = fit['beta'][valid]
+    alpha = fit['alpha'][valid] * fit['n'][valid]  # Alpha over the whole period
+    r_squared = fit['r_squared'][valid]
+
+    # Performance attribution
+    total_return = cumret[tickers].iloc[-1].to_numpy()[valid]
+    portfolio_total_return = cumret['Portfolio'].iloc[-1]
+    period_length_years = len(logret) / 252  # Assuming 252 trading days per year
+    perf_from_beta = (beta - 1) * portfolio_total_return
+    perf_from_alpha = alpha * period_length_years
+
+    # Volatility attribution (annualized)
+    ticker_vol = logret[tickers].std().to_numpy()[valid] * np.sqrt(252)
+    portfolio_vol = portfolio_returns.std() * np.sqrt(252)
+    vol_from_beta = (beta - 1) * portfolio_vol
+
+    df_regression = pd.DataFrame({
+        'Alpha': alpha,
+        'Beta': beta,
+        'Correlation R': np.sqrt(r_squared),
+        'Variance Explained R2': r_squared,
+        'Significant': fit['f_pvalue'][valid] < 0.05,
+        'Perf_Portfolio': portfolio_total_return,
+        'Perf_Beta': perf_from_beta,
+        'Perf_Alpha': perf_from_alpha,
+        'Perf_Error': total_return - portfolio_total_return - perf_from_beta - perf_from_alpha,
+        'Total_Return': total_return,
+        'Vol_Portfolio': portfolio_vol,
+        'Vol_Beta': vol_from_beta,
+        'Vol_Error': ticker_vol - abs(portfolio_vol) - np.abs(vol_from_beta),
+        'Total_Vol': ticker_vol
+    }, index=pd.Index(np.asarray(tickers, dtype=object)[valid], name='Ticker'))
+
+    # Round numeric columns for better display
+    numeric_cols = df_regression.select_dtypes(include=['float64']).columns
+    df_regression[numeric_cols] = df_regression[numeric_cols].round(4)
     
-    # Loop through each ticker
+    return df_regression
+
+def rolling_regression(y, x, windows=(None,), min_periods=None):
+    """
+    Rolling regressions of every column of y on x for several window lengths.
+
+    Each window's statistics come from differences of running sums that are
+    shared by all windows, so every window costs O(dates x tickers) whatever
+    its length. Observations where either series is not finite are masked out.
+
+    Args:
+        y: (dates x tickers) array of returns
+        x: (dates,) array of benchmark returns
+        windows: window lengths in dates, None for an expanding window
+        min_periods: fewest valid observations for an estimate (default: 80% of
+            the window and at least 20, so a few missing returns do not blank it)
+
+    Returns:
+        dict keyed by window of dicts of (dates x tickers) arrays:
+        alpha (per day), beta, r_squared
+    """
+    mask = np.isfinite(y) & np.isfinite(x)[:, None]
+
+    # Shift both series by their overall means to keep the running sums well conditioned
+    x_shift = np.nanmean(np.where(np.isfinite(x), x, np.nan))
+    y_shift = np.nanmean(np.where(mask, y, np.nan), axis=0)
+    dx = np.where(mask, x[:, None] - x_shift, 0.0)
+    dy = np.where(mask, y - y_shift, 0.0)
+
+    # Running sums with a leading row of zeros
+    running = {}
+    for name, values in [('n', mask), ('x', dx), ('y', dy), ('xx', dx * dx), ('xy', dx * dy), ('yy', dy * dy)]:
+        running[name] = np.zeros((len(y) + 1, y.shape[1]))
+        np.cumsum(values, axis=0, out=running[name][1:])
+    del mask, dx, dy
+
+    fits = {}
+    ends = np.arange(1, len(y) + 1)
+    for window in windows:
+        if window is None:
+            sums = {name: values[1:] for name, values in running.items()}
+        else:
+            sums = {name: values[ends] - values[np.maximum(ends - window, 0)] for name, values in running.items()}
+        n = sums['n']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            var_x = sums['xx'] - sums['x'] ** 2 / n
+            var_y = sums['yy'] - sums['y'] ** 2 / n
+            cov_xy = sums['xy'] - sums['x'] * sums['y'] / n
+            beta = cov_xy / var_x
+            alpha = (sums['y'] - beta * sums['x']) / n + y_shift - beta * x_shift
+            r_squared = cov_xy ** 2 / (var_x * var_y)
+
+        too_short = n < max(min_periods or max(20, int(0.8 * (window or 0))), 3)
+        for values in (alpha, beta, r_squared):
+            values[too_short] = np.nan
+        fits[window] = {'alpha': alpha, 'beta': beta, 'r_squared': r_squared}
+    return fits
+
+def calculate_rolling_alpha_beta(tall, windows=(63, 126, 252)):
+    """
+    Rolling alpha, beta and R2 of every ticker against the Portfolio series.
+
+    Returns a dict keyed by window length (None for expanding) of dicts with
+    'Alpha' (annualized), 'Beta' and 'R2' DataFrames (dates x tickers)
+    """
+    logret = get_panel(tall, 'logret')
+    y = logret.to_numpy(dtype=float)
+    x = logret['Portfolio'].to_numpy(dtype=float)
+
+    rolling = {}
+    for window, fit in rolling_regression(y, x, windows=windows).items():
+        rolling[window] = {
+            'Alpha': pd.DataFrame(fit['alpha'] * 252, index=logret.index, columns=logret.columns),
+            'Beta': pd.DataFrame(fit['beta'], index=logret.index, columns=logret.columns),
+            'R2': pd.DataFrame(fit['r_squared'], index=logret.index, columns=logret.columns)
+        }
+    return rolling
+
+def fig_rolling_ab(rolling, ticker):
+    """
+    Rolling beta, annualized alpha and R2 of one ticker for each window length
+    """
+    fig = make_subplots(rows=3, cols=1, shared_xaxes=True, vertical_spacing=0.05,
+                        subplot_titles=("Rolling Beta", "Rolling Alpha (annualized)", "Rolling R2"))
+    colors = px.colors.qualitative.Plotly
+    for i, (window, panels) in enumerate(rolling.items()):
+        name = f"{window}d" if window else "Expanding"
+        for row, metric in enumerate(['Beta', 'Alpha', 'R2'], start=1):
+            series = panels[metric][ticker]
+            fig.add_trace(
+                go.Scatter(x=series.index, y=series, mode='lines', name=name,
+                           line=dict(color=colors[i % len(colors)]), showlegend=row == 1),
+                row=row, col=1
+            )
+    fig.add_hline(y=1, line=dict(color='#A9A9A9', dash='dash'), row=1, col=1)
+    fig.update_yaxes(row=2, col=1, tickformat=".1%")
+    fig.update_yaxes(row=3, col=1, tickformat=".0%", range=[0, 1])
+    fig.update_layout(height=600, template="plotly_white",
+                      legend=dict(orientation="h", yanchor="bottom", y=1.05, xanchor="right", x=1))
+    return fig
+
+def _regression_metrics_statsmodels(logret, tickers):
+    """
+    Reference per-ticker statsmodels OLS used by the parity check:
+    returns period alpha, beta, R2 and F-test p-value per ticker
+    """
+    results = {}
     for ticker in tickers:
-        ticker_data = tall.loc[ticker]
-        ticker_returns = ticker_data['logret']
-        
-        # Prepare data for regression
         valid_data = pd.DataFrame({
-            'portfolio': portfolio_returns,
-            'ticker': ticker_returns
-        }).dropna().replace([np.inf, -np.inf], np.nan).dropna()
-        
-        # Skip if not enough data
+            'portfolio': logret['Portfolio'],
+            'ticker': logret[ticker]
+        }).replace([np.inf, -np.inf], np.nan).dropna()
         if len(valid_data) <= 2:
             continue
-            
-        # Add constant for statsmodels (for alpha)
-        X = sm.add_constant(valid_data['portfolio'])
-        y = valid_data['ticker']
-        
-        # Run regression
-        try:
-            model = sm.OLS(y, X).fit()
-            
-            # Extract regression statistics
-            alpha = model.params['const'] * len(y)  # Annualized alpha
-            beta = model.params['portfolio']
-            r_squared = model.rsquared
-            correl_r = np.sqrt(model.rsquared)
-            p_value = model.f_pvalue
-            significant = p_value < 0.05
-            
-            # Performance attribution
-            # Calculate total performance (from cumulative returns)
-            total_return = tall.loc[ticker]['cumret'].iloc[-1]
-            portfolio_total_return = tall.loc['Portfolio']['cumret'].iloc[-1]
-            
-            # Performance from portfolio return
-            perf_from_portfolio = portfolio_total_return
-            
-            # Performance from beta adjustment
-            perf_from_beta = (beta - 1) * portfolio_total_return
-            
-            # Performance from alpha (annualized alpha needs to be converted to the period's alpha)
-            period_length_years = len(ticker_data) / 252  # Assuming 252 trading days per year
-            perf_from_alpha = alpha * period_length_years
-            
-            # Performance error (residual to match total return)
-            perf_error = total_return - perf_from_portfolio - perf_from_beta - perf_from_alpha
-            
-            # Volatility attribution
-            ticker_vol = ticker_returns.std() * np.sqrt(252)  # Annualized
-            portfolio_vol = portfolio_returns.std() * np.sqrt(252)  # Annualized
-            
-            # Vol from portfolio
-            vol_from_portfolio = portfolio_vol
-            
-            # Vol from beta adjustment
-            vol_from_beta = (beta - 1) * portfolio_vol
-            
-            # Total vol (actual ticker volatility)
-            total_vol = ticker_vol
-            
-            # Vol error (residual)
-            vol_error = total_vol - abs(vol_from_portfolio) - abs(vol_from_beta)
-            
-            # Store results
-            results.append({
-                'Ticker': ticker,
-                'Alpha': alpha,
-                'Beta': beta,
-                'Correlation R': correl_r,
-                'Variance Explained R2': r_squared,
-                'Significant': significant,
-                'Perf_Portfolio': perf_from_portfolio,
-                'Perf_Beta': perf_from_beta,
-                'Perf_Alpha': perf_from_alpha,
-                'Perf_Error': perf_error,
-                'Total_Return': total_return,
-                'Vol_Portfolio': vol_from_portfolio,
-                'Vol_Beta': vol_from_beta,
-                'Vol_Error': vol_error,
-                'Total_Vol': total_vol
-            })
-            
-        except Exception as e:
-            st.warning(f"Could not calculate regression for {ticker}: {e}")
-    
-    # Create DataFrame from results
-    df_regression = pd.DataFrame(results)
-    
-    if not df_regression.empty:
-        # Format the DataFrame
-        df_regression.set_index('Ticker', inplace=True)
-        
-        # Round numeric columns for better display
-        numeric_cols = df_regression.select_dtypes(include=['float64']).columns
-        df_regression[numeric_cols] = df_regression[numeric_cols].round(4)
-    
-    return df_regression
+        model = sm.OLS(valid_data['ticker'], sm.add_constant(valid_data['portfolio'])).fit()
+        results[ticker] = {
+            'Alpha': model.params['const'] * len(valid_data),
+            'Beta': model.params['portfolio'],
+            'Variance Explained R2': model.rsquared,
+            'p-value': model.f_pvalue
+        }
+    return pd.DataFrame.from_dict(results, orient='index')
+
+def _synthetic_tall(n_tickers, n_dates, missing=0.02, seed=0):
+    """
+    Random tall frame (Ticker, Date) with logret and cumret and a few missing returns
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end='2024-12-31', periods=n_dates)
+    market = rng.normal(0.0003, 0.01, n_dates)
+    betas = rng.uniform(0.5, 1.5, n_tickers)
+    logret = market[:, None] * betas + rng.normal(0, 0.015, (n_dates, n_tickers))
+    logret[rng.random(logret.shape) < missing] = np.nan
+    logret[0] = np.nan
+    tickers = [f"T{i:05d}" for i in range(n_tickers)]
+    wide = pd.DataFrame(logret, index=dates, columns=tickers)
+    wide['Portfolio'] = np.nan
+    wide.iloc[1:, -1] = np.nanmean(logret[1:], axis=1)
+    cumret = np.exp(wide.cumsum()) - 1
+    cumret.iloc[0] = 0
+    tall = pd.concat({'logret': wide.unstack(), 'cumret': cumret.unstack()}, axis=1)
+    tall.index.names = ['Ticker', 'Date']
+    return tall
+
+# Largest differences from statsmodels allowed by the parity check
+PARITY_RTOL = 1e-9
+PARITY_ATOL = 1e-12
+
+def benchmark_regression_metrics(sizes=(50, 500, 2000), n_dates=252, statsmodels_max_tickers=500):
+    """
+    Time calculate_regression_metrics() against per-ticker statsmodels OLS and
+    report the largest absolute differences from statsmodels.
+    Raises AssertionError if alpha, beta, R2 or the p-value differ from
+    statsmodels by more than PARITY_RTOL / PARITY_ATOL.
+    """
+    rows = []
+    for n_tickers in sizes:
+        tall = _synthetic_tall(n_tickers, n_dates)
+
+        start = time.perf_counter()
+        df_regression = calculate_regression_metrics(tall)
+        batched_seconds = time.perf_counter() - start
+
+        row = {'Tickers': n_tickers, 'Dates': n_dates, 'Batched seconds': batched_seconds}
+        if n_tickers <= statsmodels_max_tickers:
+            logret = get_panel(tall, 'logret')
+            tickers = [ticker for ticker in logret.columns if ticker != 'Portfolio']
+            start = time.perf_counter()
+            reference = _regression_metrics_statsmodels(logret, tickers)
+            row['statsmodels seconds'] = time.perf_counter() - start
+
+            # Compare the unrounded batched estimates
+            fit = batched_regression(logret[tickers].to_numpy(), logret['Portfolio'].to_numpy())
+            batched = pd.DataFrame({
+                'Alpha': fit['alpha'] * fit['n'],
+                'Beta': fit['beta'],
+                'Variance Explained R2': fit['r_squared'],
+                'p-value': fit['f_pvalue']
+            }, index=tickers).loc[reference.index]
+            for col in reference.columns:
+                row[f"Max diff {col}"] = (batched[col] - reference[col]).abs().max()
+                np.testing.assert_allclose(batched[col], reference[col], rtol=PARITY_RTOL, atol=PARITY_ATOL,
+                                           err_msg=f"{col} differs from statsmodels for {n_tickers} tickers")
+        rows.append(row)
+    return pd.DataFrame(rows)
 
 def fig_ab(ptf, tall, ticker):
     # Extract ticker-specific data
@@ -329,13 +499,28 @@ def main():
         fig = fig_ab(ptf, tall, ticker)
         
         st.plotly_chart(fig, use_container_width=True)
+
+        # Rolling alpha/beta panels for every ticker, computed once per tall frame,
+        # for the windows shorter than the history
+        n_dates = len(get_panel(tall, 'logret'))
+        windows = tuple(window for window in (63, 126, 252) if window < n_dates)
+        if len(windows) < 3:
+            st.caption(f"Rolling windows of {n_dates} days or more are not offered: the history has {n_dates} days.")
+        with st.spinner("Calculating rolling alpha and beta for all tickers..."):
+            rolling = memoize(tall, ('rolling_alpha_beta', windows + (None,)),
+                              lambda: calculate_rolling_alpha_beta(tall, windows=windows + (None,)))
+
+        windows = st.multiselect("Rolling windows", list(rolling), default=list(windows),
+                                 format_func=lambda window: f"{window} days" if window else "Expanding")
+        st.plotly_chart(fig_rolling_ab({window: rolling[window] for window in windows}, ticker),
+                        use_container_width=True)
     
     with tab2:
         st.subheader("Regression Analysis for All Tickers")
         
         # Calculate regression metrics for all tickers
         with st.spinner("Calculating regression metrics for all tickers..."):
-            df_regression = calculate_regression_metrics(tall)
+            df_regression = memoize(tall, 'regression_metrics', lambda: calculate_regression_metrics(tall))
         
         if df_regression is not None and not df_regression.empty:
             # Display the regression metrics
@@ -366,5 +551,13 @@ def main():
         else:
             st.warning("Could not calculate regression metrics. Make sure your data has enough valid points.")
 
+        with st.expander("Benchmark the batched regression engine"):
+            if st.button("Run benchmark"):
+                with st.spinner("Comparing with per-ticker statsmodels OLS..."):
+                    try:
+                        st.dataframe(benchmark_regression_metrics())
+                    except AssertionError as e:
+                        st.error(f"Parity check against statsmodels failed: {e}")
+
 if __name__ == "__main__":
     main()
@@ -1,5 +1,327 @@
 import streamlit as st
+import numpy as np
+import pandas as pd
+import time
+import plotly.graph_objects as go
+from scipy.optimize import minimize
+from sklearn.covariance import LedoitWolf
+from panel_store import get_panel, memoize
+
+
+def estimate_moments(logret, shrinkage=True):
+    """
+    Annualized expected returns and covariance of the columns of logret.
+
+    Missing returns are set to the ticker's mean before estimating the
+    covariance. With shrinkage the Ledoit-Wolf estimator pulls the sample
+    covariance towards a scaled identity, which keeps it well conditioned
+    when there are many assets relative to the number of dates.
+
+    Returns:
+        (mu, cov, shrinkage_intensity) with mu as (N,) and cov as (N x N) arrays
+    """
+    values = logret.to_numpy(dtype=float)
+    mean = np.nan_to_num(np.nanmean(values, axis=0))
+    centred = np.nan_to_num(values - mean)
+
+    if shrinkage:
+        estimator = LedoitWolf(assume_centered=True).fit(centred)
+        cov, intensity = estimator.covariance_ * len(centred) / (len(centred) - 1), estimator.shrinkage_
+    else:
+        cov, intensity = centred.T @ centred / (len(centred) - 1), 0.0
+    return mean * 252, cov * 252, intensity
+
+
+def project_box_simplex(v, lower, upper, total=1.0):
+    """
+    Euclidean projection of v on {w : sum(w) = total, lower <= w <= upper}.
+
+    The projection is clip(v - tau, lower, upper) for the tau that meets the
+    budget. The budget is piecewise linear in tau with breakpoints at v - upper
+    and v - lower, so sorting the breakpoints locates the segment and tau is
+    interpolated exactly within it.
+    """
+    lower = np.broadcast_to(lower, v.shape)
+    upper = np.broadcast_to(upper, v.shape)
+    breakpoints = np.concatenate([v - upper, v - lower])
+    # Passing a v - upper breakpoint frees a weight from its upper bound, passing v - lower pins it to the lower one
+    slope_change = np.concatenate([np.ones(len(v)), -np.ones(len(v))])
+    order = np.argsort(breakpoints, kind='stable')
+    breakpoints, slope_change = breakpoints[order], slope_change[order]
+
+    free = np.cumsum(slope_change)[:-1]
+    sums = upper.sum() - np.concatenate([[0.0], np.cumsum(free * np.diff(breakpoints))])
+    # sums decreases from sum(upper) to sum(lower); find the segment where it crosses the budget
+    k = np.clip(np.searchsorted(-sums, -total, side='left'), 1, len(sums) - 1)
+    span = sums[k - 1] - sums[k]
+    fraction = (sums[k - 1] - total) / span if span > 0 else 0.0
+    tau = breakpoints[k - 1] + fraction * (breakpoints[k] - breakpoints[k - 1])
+    return np.clip(v - tau, lower, upper)
+
+
+def largest_eigenvalue(cov, n_iter=50):
+    """Largest eigenvalue of a covariance matrix by power iteration."""
+    v = np.ones(len(cov)) / np.sqrt(len(cov))
+    for _ in range(n_iter):
+        v = cov @ v
+        v /= np.linalg.norm(v)
+    return float(v @ cov @ v)
+
+
+def solve_mean_variance(cov, mu, return_weight, lower, upper, w0=None, step=None, tol=1e-7, max_iter=5000):
+    """
+    Minimize w' cov w - return_weight * mu' w over the box-constrained budget set
+    with accelerated projected gradient (FISTA with adaptive restart).
+
+    A return_weight of 0 gives the minimum-variance portfolio. Passing the
+    solution of a nearby problem as w0 (warm start) cuts the iterations.
+
+    Returns:
+        (weights, iterations)
+    """
+    if step is None:
+        step = 1 / (2 * largest_eigenvalue(cov))
+    w = project_box_simplex(np.full(len(mu), 1 / len(mu)) if w0 is None else w0, lower, upper)
+    y, t = w.copy(), 1.0
+    for iteration in range(1, max_iter + 1):
+        gradient = 2 * (cov @ y) - return_weight * mu
+        w_next = project_box_simplex(y - step * gradient, lower, upper)
+        converged = np.max(np.abs(w_next - w)) < tol
+        # Restart the momentum when it points uphill
+        if (y - w_next) @ (w_next - w) > 0:
+            t = 1.0
+        t_next = (1 + np.sqrt(1 + 4 * t * t)) / 2
+        y = w_next + (t - 1) / t_next * (w_next - w)
+        w, t = w_next, t_next
+        if converged:
+            break
+    return w, iteration
+
+
+def max_return_portfolio(mu, lower, upper):
+    """Highest expected return under the constraints: fill the best assets up to their upper bound."""
+    lower = np.broadcast_to(lower, mu.shape).astype(float)
+    upper = np.broadcast_to(upper, mu.shape).astype(float)
+    weights = lower.copy()
+    budget = 1.0 - lower.sum()
+    for i in np.argsort(-mu, kind='stable'):
+        add = min(upper[i] - lower[i], budget)
+        weights[i] += add
+        budget -= add
+        if budget <= 0:
+            break
+    return weights
+
+
+def portfolio_stats(weights, mu, cov, risk_free=0.0):
+    """Expected return, volatility and Sharpe ratio of a portfolio."""
+    ret = float(weights @ mu)
+    vol = float(np.sqrt(max(weights @ cov @ weights, 0)))
+    return ret, vol, (ret - risk_free) / vol if vol > 0 else np.nan
+
+
+def efficient_frontier(mu, cov, lower, upper, n_points=40, risk_free=0.0, warm_start=True, refine_steps=12):
+    """
+    Sweep the efficient frontier from the minimum-variance portfolio towards
+    the maximum-return one, then refine the maximum-Sharpe portfolio.
+
+    Each frontier point warm-starts from the previous one. The maximum-Sharpe
+    portfolio is found by a golden-section search on the return weight
+    between the neighbours of the best frontier point.
+
+    Returns:
+        dict with the frontier 'weights' (points x N), 'returns', 'vols',
+        'sharpes', the 'min_variance' and 'max_sharpe' weights and the total
+        number of solver 'iterations'
+    """
+    step = 1 / (2 * largest_eigenvalue(cov))
+    # Return weights from 0 (minimum variance) to where returns dominate the risk term
+    spread = max(mu.max() - mu.min(), 1e-12)
+    scale = 2 * np.diag(cov).max() / spread
+    return_weights = np.concatenate([[0.0], scale * np.geomspace(1e-3, 10, n_points - 2)])
+
+    weights, iterations, w = [], 0, None
+    for return_weight in return_weights:
+        w, n_iter = solve_mean_variance(cov, mu, return_weight, lower, upper, w0=w if warm_start else None, step=step)
+        weights.append(w)
+        iterations += n_iter
+    # The frontier ends at the maximum-return portfolio
+    weights.append(max_return_portfolio(mu, lower, upper))
+    return_weights = np.append(return_weights, np.inf)
+    weights = np.array(weights)
+    stats = np.array([portfolio_stats(w, mu, cov, risk_free) for w in weights])
+
+    # Golden-section search for the maximum Sharpe ratio between the neighbours of the best point
+    best = int(np.nanargmax(stats[:, 2]))
+    low = return_weights[max(best - 1, 0)]
+    high = return_weights[min(best + 1, n_points - 2)]
+    w_best = weights[best]
+    sharpe_best = stats[best, 2]
+    ratio = (np.sqrt(5) - 1) / 2
+    for _ in range(refine_steps):
+        points = [high - ratio * (high - low), low + ratio * (high - low)]
+        candidates = []
+        for return_weight in points:
+            w, n_iter = solve_mean_variance(cov, mu, return_weight, lower, upper, w0=w_best, step=step)
+            iterations += n_iter
+            candidates.append((portfolio_stats(w, mu, cov, risk_free)[2], w))
+        if candidates[0][0] >= candidates[1][0]:
+            high = points[1]
+        else:
+            low = points[0]
+        for sharpe, w in candidates:
+            if sharpe > sharpe_best:
+                sharpe_best, w_best = sharpe, w
+
+    return {
+        'weights': weights,
+        'returns': stats[:, 0],
+        'vols': stats[:, 1],
+        'sharpes': stats[:, 2],
+        'min_variance': weights[0],
+        'max_sharpe': w_best,
+        'iterations': iterations
+    }
+
+
+def _synthetic_moments(n_assets, n_dates=1260, n_factors=10, seed=0):
+    """Expected returns and a factor-model sample of returns for the benchmark."""
+    rng = np.random.default_rng(seed)
+    exposures = rng.normal(0, 1, size=(n_factors, n_assets))
+    exposures[0] += 1
+    factors = rng.normal(0, 0.006, size=(n_dates, n_factors))
+    values = factors @ exposures + rng.normal(0, 0.015, size=(n_dates, n_assets)) + rng.normal(0.0003, 0.0003, n_assets)
+    return pd.DataFrame(values)
+
+
+def benchmark_optimizer(sizes=(100, 500, 1000, 2000), n_points=40, max_weight=0.05, cold_max_assets=500,
+                        slsqp_max_assets=100):
+    """
+    Time the covariance estimate, the minimum-variance solve and the frontier
+    sweep (warm-started, and cold up to cold_max_assets) against universe size.
+    For small universes the minimum-variance weights are checked against
+    scipy's SLSQP.
+
+    Returns:
+        DataFrame with one row per universe size
+    """
+    rows = []
+    for n_assets in sizes:
+        logret = _synthetic_moments(n_assets)
+        lower, upper = 0.0, max(max_weight, 1.5 / n_assets)
+        row = {'Assets': n_assets}
+
+        start = time.perf_counter()
+        mu, cov, _ = estimate_moments(logret)
+        row['Ledoit-Wolf seconds'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        w_min, _ = solve_mean_variance(cov, mu, 0.0, lower, upper)
+        row['Min variance seconds'] = time.perf_counter() - start
+
+        for warm_start in (True, False):
+            if not warm_start and n_assets > cold_max_assets:
+                continue
+            start = time.perf_counter()
+            frontier = efficient_frontier(mu, cov, lower, upper, n_points=n_points, warm_start=warm_start, refine_steps=0)
+            label = 'warm' if warm_start else 'cold'
+            row[f"Frontier seconds ({label})"] = time.perf_counter() - start
+            row[f"Frontier iterations ({label})"] = frontier['iterations']
+
+        if n_assets <= slsqp_max_assets:
+            start = time.perf_counter()
+            result = minimize(lambda w: w @ cov @ w, np.full(n_assets, 1 / n_assets), jac=lambda w: 2 * (cov @ w),
+                              bounds=[(lower, upper)] * n_assets, method='SLSQP',
+                              constraints=[{'type': 'eq', 'fun': lambda w: w.sum() - 1}], options={'ftol': 1e-12})
+            row['SLSQP seconds'] = time.perf_counter() - start
+            row['Vol diff vs SLSQP'] = np.sqrt(w_min @ cov @ w_min) - np.sqrt(result.x @ cov @ result.x)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def fig_frontier(frontier, mu, cov, tickers, risk_free=0.0):
+    """Efficient frontier with the individual assets, the minimum-variance and maximum-Sharpe portfolios."""
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=np.sqrt(np.diag(cov)), y=mu, mode='markers', name='Assets',
+        marker=dict(color='#A9A9A9', size=6, opacity=0.5), text=tickers,
+        hovertemplate='%{text}<br>Vol: %{x:.1%}<br>Return: %{y:.1%}<extra></extra>'
+    ))
+    fig.add_trace(go.Scatter(
+        x=frontier['vols'], y=frontier['returns'], mode='lines+markers', name='Efficient Frontier',
+        line=dict(color='#1f77b4'), marker=dict(size=4),
+        customdata=frontier['sharpes'], hovertemplate='Vol: %{x:.1%}<br>Return: %{y:.1%}<br>Sharpe: %{customdata:.2f}<extra></extra>'
+    ))
+    for name, key, symbol in [('Min Variance', 'min_variance', 'square'), ('Max Sharpe', 'max_sharpe', 'star')]:
+        ret, vol, sharpe = portfolio_stats(frontier[key], mu, cov, risk_free)
+        fig.add_trace(go.Scatter(
+            x=[vol], y=[ret], mode='markers+text', name=name, text=[name], textposition='top center',
+            marker=dict(size=14, symbol=symbol, color='#d62728'),
+            hovertemplate=f'{name}<br>Vol: %{{x:.1%}}<br>Return: %{{y:.1%}}<br>Sharpe: {sharpe:.2f}<extra></extra>'
+        ))
+    fig.update_layout(
+        title="Efficient Frontier", xaxis_title="Volatility", yaxis_title="Expected Return",
+        xaxis_tickformat=".0%", yaxis_tickformat=".0%", height=600, template="plotly_white"
+    )
+    return fig
+
 
 def main():
     st.title("p-Sharpe Portfolio")
-    st.write("This is the content of the n-Sharpe Portfolio page.")
\ No newline at end of file
+    st.write("""
+    Mean-variance optimization over the whole holdings list: the minimum-variance
+    and maximum-Sharpe portfolios and the efficient frontier between them, under
+    long-only and maximum-weight constraints. Expected returns are historical
+    means; the covariance uses Ledoit-Wolf shrinkage so that it stays well
+    conditioned for large universes.
+    """)
+
+    ptf = st.session_state.get('ptf')
+    tall = st.session_state.get('tall')
+    if ptf is None or tall is None:
+        st.warning("No portfolio data found in session state. Go back!")
+        return
+
+    logret = get_panel(tall, 'logret')
+    tickers = [ticker for ticker in ptf['Ticker'].unique() if ticker in logret.columns]
+    if len(tickers) < 2:
+        st.warning("At least two holdings with price history are needed.")
+        return
+    logret = logret[tickers].iloc[1:]
+
+    col1, col2, col3 = st.columns(3)
+    long_only = col1.checkbox("Long only", value=True)
+    shrinkage = col1.checkbox("Ledoit-Wolf shrinkage", value=True)
+    max_weight = col2.slider("Maximum weight per holding", min_value=0.01, max_value=1.0, value=0.2, step=0.01)
+    n_points = col2.slider("Frontier points", min_value=10, max_value=100, value=40, step=5)
+    risk_free = col3.number_input("Risk-free rate", value=0.0, step=0.005, format="%.3f")
+
+    # The budget must be reachable with the maximum weight
+    max_weight = max(max_weight, 1 / len(tickers))
+    lower = 0.0 if long_only else -max_weight
+
+    mu, cov, intensity = memoize(tall, ('moments', tuple(tickers), shrinkage), lambda: estimate_moments(logret, shrinkage))
+    with st.spinner("Optimizing..."):
+        frontier = memoize(tall, ('frontier', tuple(tickers), shrinkage, long_only, max_weight, n_points, risk_free),
+                           lambda: efficient_frontier(mu, cov, lower, max_weight, n_points=n_points, risk_free=risk_free))
+    if shrinkage:
+        st.caption(f"Ledoit-Wolf shrinkage intensity: {intensity:.1%}")
+
+    st.plotly_chart(fig_frontier(frontier, mu, cov, tickers, risk_free), use_container_width=True)
+
+    summary = pd.DataFrame(
+        [portfolio_stats(frontier[key], mu, cov, risk_free) for key in ('min_variance', 'max_sharpe')],
+        index=['Min Variance', 'Max Sharpe'], columns=['Return', 'Volatility', 'Sharpe']
+    )
+    st.dataframe(summary.style.format({'Return': '{:.1%}', 'Volatility': '{:.1%}', 'Sharpe': '{:.2f}'}))
+
+    weights = pd.DataFrame({'Min Variance': frontier['min_variance'], 'Max Sharpe': frontier['max_sharpe']}, index=tickers)
+    weights = weights[(weights.abs() > 1e-6).any(axis=1)].sort_values('Max Sharpe', ascending=False)
+    st.subheader("Portfolio Weights")
+    st.bar_chart(weights.head(50))
+    st.dataframe(weights.style.format('{:.2%}'))
+
+    with st.expander("Benchmark the optimizer"):
+        if st.button("Run benchmark"):
+            with st.spinner("Solving synthetic universes of increasing size..."):
+                st.dataframe(benchmark_optimizer())
@@ -1,5 +1,331 @@
 import streamlit as st
+import numpy as np
+import pandas as pd
+import os
+import time
+import plotly.graph_objects as go
+from concurrent.futures import ProcessPoolExecutor
+from panel_store import get_panel
+
+METRICS = ['Return', 'Volatility', 'Sharpe', 'Max Drawdown']
+SIMULATION_METHODS = {
+    'weights': "Random weights (Dirichlet)",
+    'bootstrap': "Bootstrapped return paths",
+}
+
+_worker_inputs = None  # simulation inputs of a worker process, set by _init_worker
+
+
+def simulation_inputs(tall, tickers):
+    """
+    Arrays shared by every simulated batch.
+
+    The actual portfolio is buy-and-hold from its starting values, so any
+    weight vector w is evaluated the same way: its value path is growth @ w,
+    where growth holds each ticker's value relative to the first date.
+
+    Returns:
+        dict with 'tickers', 'growth' (dates x tickers, float32),
+        'weights' (actual starting weights) and 'logret' (the actual
+        portfolio's daily log returns)
+    """
+    logret = get_panel(tall, 'logret')[tickers]
+    value = get_panel(tall, 'value')[tickers]
+
+    growth = np.exp(np.nancumsum(logret.to_numpy(dtype=np.float64), axis=0)).astype(np.float32)
+    start_value = np.nan_to_num(value.iloc[0].to_numpy(dtype=float))
+    weights = start_value / start_value.sum()
+    path = growth @ weights.astype(np.float32)
+    return {
+        'tickers': list(tickers),
+        'growth': growth,
+        'weights': weights,
+        'logret': np.diff(np.log(path)),
+    }
+
+
+def path_metrics(values):
+    """
+    Annualized return, volatility, Sharpe ratio and maximum drawdown of value
+    paths that start at 1.
+
+    Parameters:
+        values: (dates x paths) array
+
+    Returns:
+        (paths x 4) array in METRICS order
+    """
+    log_values = np.log(values)
+    logret = np.diff(log_values, axis=0)
+    years = len(logret) / 252
+    vol = logret.std(axis=0, ddof=1) * np.sqrt(252)
+    ann_return = np.exp(log_values[-1] / years) - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = logret.mean(axis=0) * 252 / vol
+    drawdown = (values / np.maximum.accumulate(values, axis=0)).min(axis=0) - 1
+    return np.column_stack([ann_return, vol, sharpe, drawdown])
+
+
+def random_weights(rng, batch_size, n_assets, concentration=1.0, n_holdings=None):
+    """
+    Random long-only weight vectors drawn from a symmetric Dirichlet distribution.
+
+    A concentration of 1 is uniform on the simplex; lower values give more
+    concentrated portfolios. With n_holdings each portfolio only holds that
+    many randomly chosen names.
+    """
+    gammas = rng.standard_gamma(concentration, size=(batch_size, n_assets), dtype=np.float32)
+    if n_holdings is not None and n_holdings < n_assets:
+        # Keep the n_holdings names with the smallest uniform keys, an independent subset per row
+        keys = rng.random((batch_size, n_assets), dtype=np.float32)
+        cutoff = np.partition(keys, n_holdings - 1, axis=1)[:, n_holdings - 1:n_holdings]
+        gammas[keys > cutoff] = 0
+    return gammas / gammas.sum(axis=1, keepdims=True)
+
+
+def bootstrap_paths(rng, batch_size, logret, block_length=20):
+    """
+    Value paths rebuilt from circular block bootstraps of daily log returns.
+    Blocks keep the short-range autocorrelation and volatility clustering.
+
+    Returns:
+        (dates x paths) float32 array of values starting at 1
+    """
+    n_dates = len(logret)
+    n_blocks = -(-n_dates // block_length)
+    starts = rng.integers(0, n_dates, size=(batch_size, n_blocks, 1))
+    index = ((starts + np.arange(block_length)) % n_dates).reshape(batch_size, -1)[:, :n_dates]
+    sampled = logret.astype(np.float32)[index].T
+    values = np.ones((n_dates + 1, batch_size), dtype=np.float32)
+    np.exp(np.cumsum(sampled, axis=0), out=values[1:])
+    return values
+
+
+def simulate_batch(inputs, method, seed, batch_size, concentration=1.0, n_holdings=None, block_length=20):
+    """
+    Draw and evaluate one batch of random portfolios.
+
+    Each batch has its own seed (a SeedSequence child) so that results do not
+    depend on how batches are spread over processes.
+
+    Returns:
+        (batch_size x 4) array in METRICS order
+    """
+    rng = np.random.default_rng(seed)
+    if method == 'weights':
+        weights = random_weights(rng, batch_size, inputs['growth'].shape[1], concentration, n_holdings)
+        values = inputs['growth'] @ weights.T
+    elif method == 'bootstrap':
+        values = bootstrap_paths(rng, batch_size, inputs['logret'], block_length)
+    else:
+        raise ValueError(f"Unknown simulation method: {method}")
+    return path_metrics(values)
+
+
+def _init_worker(inputs):
+    global _worker_inputs
+    _worker_inputs = inputs
+
+
+def _simulate_worker_batch(args):
+    return simulate_batch(_worker_inputs, *args)
+
+
+def run_simulation(inputs, method='weights', n_portfolios=100_000, batch_size=5_000, seed=0, n_workers=1,
+                   concentration=1.0, n_holdings=None, block_length=20):
+    """
+    Simulate n_portfolios random portfolios in batches of batch_size.
+
+    Memory is bounded by the batch: a batch's value paths (dates x
+    batch_size, float32) are reduced to four metrics before the next batch
+    is drawn. With n_workers > 1 the batches run on a process pool that
+    receives the inputs once per worker. Every batch is seeded from
+    SeedSequence(seed).spawn, so a seed reproduces the same portfolios for
+    any number of workers.
+
+    Returns:
+        dict with 'metrics' (DataFrame, one row per portfolio), 'seconds'
+        and 'throughput' (portfolios per second)
+    """
+    sizes = [batch_size] * (n_portfolios // batch_size)
+    if n_portfolios % batch_size:
+        sizes.append(n_portfolios % batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(method, child, size, concentration, n_holdings, block_length) for child, size in zip(seeds, sizes)]
+
+    start = time.perf_counter()
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(inputs,)) as executor:
+            results = list(executor.map(_simulate_worker_batch, tasks))
+    else:
+        results = [simulate_batch(inputs, *task) for task in tasks]
+    seconds = time.perf_counter() - start
+
+    return {
+        'metrics': pd.DataFrame(np.concatenate(results), columns=METRICS),
+        'seconds': seconds,
+        'throughput': n_portfolios / seconds,
+    }
+
+
+def actual_metrics(inputs):
+    """Metrics of the actual portfolio, computed like the simulated ones."""
+    values = np.exp(np.concatenate([[0.0], np.cumsum(inputs['logret'])]))
+    return pd.Series(path_metrics(values[:, None])[0], index=METRICS)
+
+
+def percentile_ranks(metrics, actual):
+    """Share of simulated portfolios below the actual portfolio for each metric."""
+    return pd.Series({column: (metrics[column] < actual[column]).mean() for column in METRICS})
+
+
+def _synthetic_inputs(n_assets, n_dates=2520, seed=0):
+    """Simulation inputs for a random universe, for the benchmark."""
+    rng = np.random.default_rng(seed)
+    logret = rng.normal(0.0003, 0.015, size=(n_dates, n_assets)) + rng.normal(0, 0.008, size=(n_dates, 1))
+    growth = np.exp(np.cumsum(logret, axis=0)).astype(np.float32)
+    weights = np.full(n_assets, 1 / n_assets)
+    return {
+        'tickers': list(range(n_assets)),
+        'growth': growth,
+        'weights': weights,
+        'logret': np.diff(np.log(growth @ weights.astype(np.float32))),
+    }
+
+
+def benchmark_simulation(n_assets=500, n_portfolios=50_000, batch_sizes=(1_000, 5_000, 20_000), n_workers=None):
+    """
+    Throughput of both simulation methods on a synthetic 10-year universe by
+    batch size, on one process and on a process pool.
+
+    Returns:
+        DataFrame with one row per method, batch size and worker count
+    """
+    inputs = _synthetic_inputs(n_assets)
+    n_workers = n_workers or os.cpu_count() or 1
+    rows = []
+    for method in SIMULATION_METHODS:
+        for batch_size in batch_sizes:
+            for workers in sorted({1, n_workers}):
+                result = run_simulation(inputs, method, n_portfolios, batch_size, n_workers=workers)
+                rows.append({
+                    'Method': method,
+                    'Batch size': batch_size,
+                    'Workers': workers,
+                    'Seconds': result['seconds'],
+                    'Portfolios / second': result['throughput'],
+                    'Batch memory (MB)': inputs['growth'].shape[0] * batch_size * 4 / 1e6,
+                })
+    return pd.DataFrame(rows)
+
+
+def fig_risk_return(metrics, actual, max_points=20_000):
+    """Scatter of simulated volatility vs return, coloured by Sharpe ratio, with the actual portfolio."""
+    sample = metrics.sample(max_points, random_state=0) if len(metrics) > max_points else metrics
+    fig = go.Figure()
+    fig.add_trace(go.Scattergl(
+        x=sample['Volatility'], y=sample['Return'], mode='markers', name='Random Portfolios',
+        marker=dict(size=3, opacity=0.4, color=sample['Sharpe'], colorscale='Viridis', showscale=True,
+                    colorbar=dict(title='Sharpe')),
+        hovertemplate='Vol: %{x:.1%}<br>Return: %{y:.1%}<extra></extra>'
+    ))
+    fig.add_trace(go.Scatter(
+        x=[actual['Volatility']], y=[actual['Return']], mode='markers+text', name='Portfolio',
+        text=['Portfolio'], textposition='top center', marker=dict(size=14, symbol='star', color='#d62728'),
+        hovertemplate='Portfolio<br>Vol: %{x:.1%}<br>Return: %{y:.1%}<extra></extra>'
+    ))
+    fig.update_layout(
+        title=f"Portfolio vs {len(metrics):,} Random Portfolios", xaxis_title="Volatility", yaxis_title="Return",
+        xaxis_tickformat=".0%", yaxis_tickformat=".0%", height=600, template="plotly_white"
+    )
+    return fig
+
+
+def fig_metric_histogram(metrics, actual, column):
+    """Distribution of one metric across the simulated portfolios, with the actual portfolio marked."""
+    fig = go.Figure(go.Histogram(x=metrics[column], nbinsx=100, marker_color='#1f77b4', opacity=0.75))
+    fig.add_vline(x=actual[column], line=dict(color='#d62728', width=2, dash='dash'),
+                  annotation_text='Portfolio', annotation_position='top')
+    fig.update_layout(title=column, height=300, template="plotly_white", showlegend=False,
+                      margin=dict(l=20, r=20, t=40, b=20))
+    return fig
+
 
 def main():
     st.title("Portfolio Blind Date")
-    st.write("This is the content of the Portfolio Blind Date page.")
\ No newline at end of file
+    st.write("""
+    How does the portfolio compare with portfolios picked blindly from the same
+    holdings? Random weights draw long-only weight vectors over the holdings;
+    bootstrapped paths replay the portfolio's own daily returns in random
+    blocks. Either way, the actual portfolio is ranked against the simulated
+    distribution of return, volatility, Sharpe ratio and maximum drawdown.
+    """)
+
+    ptf = st.session_state.get('ptf')
+    tall = st.session_state.get('tall')
+    if ptf is None or tall is None:
+        st.warning("No portfolio data found in session state. Go back!")
+        return
+
+    logret = get_panel(tall, 'logret')
+    tickers = [ticker for ticker in ptf['Ticker'].unique() if ticker in logret.columns and ticker != 'Portfolio']
+    if len(tickers) < 2:
+        st.warning("At least two holdings with price history are needed.")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    method = col1.radio("Simulation", list(SIMULATION_METHODS), format_func=SIMULATION_METHODS.get)
+    n_portfolios = col2.select_slider("Portfolios", options=[10_000, 50_000, 100_000, 250_000, 500_000], value=100_000)
+    batch_size = col2.select_slider("Batch size", options=[1_000, 2_000, 5_000, 10_000, 20_000], value=5_000)
+    seed = col3.number_input("Seed", min_value=0, value=0, step=1)
+    n_workers = int(col3.number_input("Worker processes", min_value=1, max_value=os.cpu_count() or 1, value=1, step=1))
+
+    concentration, n_holdings, block_length = 1.0, None, 20
+    if method == 'weights':
+        concentration = col1.slider("Dirichlet concentration", min_value=0.1, max_value=5.0, value=1.0, step=0.1)
+        if col1.checkbox("Limit the number of holdings"):
+            n_holdings = col1.slider("Holdings per portfolio", min_value=1, max_value=len(tickers),
+                                     value=min(30, len(tickers)))
+    else:
+        block_length = col1.slider("Block length (days)", min_value=1, max_value=120, value=20)
+
+    inputs = simulation_inputs(tall, tickers)
+    actual = actual_metrics(inputs)
+    params = (method, n_portfolios, batch_size, int(seed), concentration, n_holdings, block_length, tuple(tickers))
+
+    if st.button("Run simulation", type="primary"):
+        with st.spinner("Simulating random portfolios..."):
+            result = run_simulation(inputs, method, n_portfolios, batch_size, int(seed), n_workers,
+                                    concentration, n_holdings, block_length)
+        st.session_state['blind_date'] = (params, result)
+
+    stored = st.session_state.get('blind_date')
+    if stored is None or stored[0] != params:
+        st.info("Set the simulation up and press Run simulation.")
+    else:
+        result = stored[1]
+        metrics = result['metrics']
+        st.caption(f"{len(metrics):,} portfolios in {result['seconds']:.2f}s "
+                   f"({result['throughput']:,.0f} portfolios/second, {n_workers} worker(s))")
+
+        st.plotly_chart(fig_risk_return(metrics, actual), use_container_width=True)
+
+        summary = pd.DataFrame({
+            'Portfolio': actual,
+            'Percentile': percentile_ranks(metrics, actual),
+            'Median': metrics.median(),
+            '5%': metrics.quantile(0.05),
+            '95%': metrics.quantile(0.95),
+        })
+        st.dataframe(summary.style.format({
+            'Portfolio': '{:.2f}', 'Percentile': '{:.0%}', 'Median': '{:.2f}', '5%': '{:.2f}', '95%': '{:.2f}'
+        }))
+
+        cols = st.columns(2)
+        for i, column in enumerate(METRICS):
+            cols[i % 2].plotly_chart(fig_metric_histogram(metrics, actual, column), use_container_width=True)
+
+    with st.expander("Benchmark the simulation"):
+        if st.button("Run benchmark"):
+            with st.spinner("Simulating a synthetic 500-name universe..."):
+                st.dataframe(benchmark_simulation())
@@ -0,0 +1,435 @@
+"""
+Panel Store Module
+
+This module keeps the wide (dates x tickers) panels derived from the tall
+portfolio dataframe, so that pages do not re-pivot tall on every rerun.
+Everything is keyed by a fingerprint of tall's contents and shared across
+pages and sessions.
+"""
+
+import hashlib
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+import numpy as np
+import pandas as pd
+import scipy.cluster.hierarchy
+
+# Number of distinct tall dataframes whose derived objects are kept in memory
+MAX_FINGERPRINTS = 4
+
+_lock = threading.Lock()
+_store = OrderedDict()  # fingerprint -> {key: object}
+_fingerprints = {}      # id(tall) -> fingerprint, dropped when tall is garbage collected
+
+
+def fingerprint(tall: pd.DataFrame) -> str:
+    """
+    Content hash of a tall dataframe (index, columns and values).
+
+    The hash is computed once per object: repeated calls with the same
+    dataframe return the memoized value.
+    """
+    key = id(tall)
+    with _lock:
+        cached = _fingerprints.get(key)
+    if cached is not None:
+        return cached
+
+    digest = hashlib.sha1(repr(list(tall.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(tall, index=True).to_numpy().tobytes())
+    value = digest.hexdigest()
+
+    with _lock:
+        if key not in _fingerprints:
+            weakref.finalize(tall, _fingerprints.pop, key, None)
+        _fingerprints[key] = value
+    return value
+
+
+def memoize(tall: pd.DataFrame, key: Hashable, builder: Callable[[], Any]) -> Any:
+    """
+    Return the object stored under key for this tall dataframe, building it on first use.
+
+    Args:
+        tall: The tall dataframe the object is derived from
+        key: Hashable name of the derived object (include any parameters)
+        builder: Zero-argument callable that builds the object
+
+    Returns:
+        The cached object. Callers must treat it as read-only.
+    """
+    fp = fingerprint(tall)
+    with _lock:
+        entry = _store.get(fp)
+        if entry is not None and key in entry:
+            _store.move_to_end(fp)
+            return entry[key]
+
+    # Build outside the lock; a concurrent duplicate build is harmless
+    value = builder()
+
+    with _lock:
+        entry = _store.setdefault(fp, {})
+        entry.setdefault(key, value)
+        _store.move_to_end(fp)
+        while len(_store) > MAX_FINGERPRINTS:
+            _store.popitem(last=False)
+        return entry[key]
+
+
+def _build_panel(tall: pd.DataFrame, column: str) -> pd.DataFrame:
+    """
+    Wide (dates x tickers) panel of one tall column, laid out like
+    tall.reset_index().pivot(index='Date', columns='Ticker', values=column)
+    """
+    index = tall.index
+    n_tickers, n_dates = len(index.levels[0]), len(index.levels[1])
+    ticker_codes, date_codes = index.codes[0], index.codes[1]
+
+    # Fast path: ticker-major, rectangular tall with every date in order (as built by perform_calculations)
+    rectangular = len(tall) == n_tickers * n_dates and n_dates > 0
+    if rectangular:
+        ticker_codes = ticker_codes.reshape(n_tickers, n_dates)
+        date_codes = date_codes.reshape(n_tickers, n_dates)
+        dates = index.levels[1][date_codes[0]]
+        rectangular = (
+            (ticker_codes == ticker_codes[:, :1]).all()
+            and (date_codes == date_codes[:1]).all()
+            and len(np.unique(ticker_codes[:, 0])) == n_tickers
+            and dates.is_monotonic_increasing and dates.is_unique
+        )
+
+    if not rectangular:
+        panel = tall[column].unstack(level=0)
+        values = np.ascontiguousarray(panel.to_numpy(dtype=float))
+        dates, tickers = panel.index, panel.columns
+    else:
+        tickers = index.levels[0][ticker_codes[:, 0]]
+        order = np.argsort(tickers.to_numpy(dtype=str), kind='stable')
+        block = tall[column].to_numpy(dtype=float).reshape(n_tickers, n_dates)
+        # One gather into (dates x tickers) with tickers sorted like pivot
+        values = np.ascontiguousarray(block[order].T)
+        tickers = tickers[order]
+
+    values.flags.writeable = False
+    return pd.DataFrame(values, index=pd.Index(dates, name='Date'), columns=pd.Index(tickers, name='Ticker'), copy=False)
+
+
+def get_panel(tall: pd.DataFrame, column: str = 'logret') -> pd.DataFrame:
+    """
+    Wide (dates x tickers) panel of a tall column ('logret', 'cumret', 'value', ...).
+
+    The panel is built once per tall dataframe and shared; the returned
+    dataframe wraps read-only data, so derive new frames instead of
+    modifying it in place.
+    """
+    panel = memoize(tall, ('panel', column), lambda: _build_panel(tall, column))
+    return panel.copy(deep=False)
+
+
+def clear():
+    """Drop every cached panel and derived object."""
+    with _lock:
+        _store.clear()
+
+
+def _pairwise_sums(values: np.ndarray, shift: np.ndarray, dtype=np.float64) -> dict:
+    """
+    Pairwise-complete sufficient statistics of the columns of values.
+
+    For every pair (i, j) only the rows where both columns are finite count.
+    Four matrix products give, over those rows: the count n, the sum sx of
+    column i, the sum of squares sxx of column i, and the cross product sxy.
+    Columns are shifted by shift first to keep the sums well conditioned.
+    """
+    mask = np.isfinite(values)
+    x = np.where(mask, values - shift, 0.0).astype(dtype, copy=False)
+    m = mask.astype(dtype)
+    return {
+        'n': (m.T @ m).astype(np.float64, copy=False),
+        'sx': (x.T @ m).astype(np.float64, copy=False),
+        'sxx': ((x * x).T @ m).astype(np.float64, copy=False),
+        'sxy': (x.T @ x).astype(np.float64, copy=False),
+    }
+
+
+def _rows_digest(values: np.ndarray) -> str:
+    """Content hash of an array of rows, to tell whether stored rows were revised."""
+    return hashlib.sha1(np.ascontiguousarray(values).tobytes()).hexdigest()
+
+
+def covariance_stats(logret: pd.DataFrame, dtype=np.float64) -> dict:
+    """
+    Sufficient statistics for the pairwise covariance of a wide returns panel.
+
+    Args:
+        logret: Wide (dates x tickers) returns, NaN where a ticker has no return
+        dtype: np.float32 for faster products on large universes, np.float64 for full precision
+
+    Returns:
+        dict with the pairwise sums, the column shift, the tickers, the dates
+        covered, the last row (needed to revise it later) and a hash of the
+        rows before it
+    """
+    values = logret.to_numpy(dtype=float)
+    shift = np.nan_to_num(np.nanmean(np.where(np.isfinite(values), values, np.nan), axis=0)) if len(values) else np.zeros(values.shape[1])
+    stats = _pairwise_sums(values, shift, dtype)
+    stats.update({'shift': shift, 'dtype': dtype, 'tickers': logret.columns, 'dates': logret.index,
+                  'last_row': values[-1:].copy(), 'digest': _rows_digest(values[:-1])})
+    return stats
+
+
+def update_covariance_stats(stats: dict, logret: pd.DataFrame) -> bool:
+    """
+    Bring covariance statistics up to date with a panel that extends them, in place.
+
+    The panel must have the same tickers, contain every date of stats up to
+    the last one and hold the same values on every date before it (prices
+    re-adjusted or positions changed since alter the whole history). The last
+    stored row is taken out again (it may have been revised intraday) and the
+    rows from that date onwards are added.
+
+    Returns:
+        True if the statistics were updated, False if the panel does not extend them
+    """
+    dates = stats['dates']
+    if not logret.columns.equals(stats['tickers']) or len(dates) == 0 or len(logret) < len(dates):
+        return False
+    if not logret.index[:len(dates)].equals(dates):
+        return False
+
+    values = logret.to_numpy(dtype=float)
+    if _rows_digest(values[:len(dates) - 1]) != stats.get('digest'):
+        return False
+    new_rows = values[len(dates) - 1:]
+    for sign, rows in ((-1.0, stats['last_row']), (1.0, new_rows)):
+        delta = _pairwise_sums(rows, stats['shift'], np.float64)
+        for key, value in delta.items():
+            stats[key] += sign * value
+
+    stats['dates'] = logret.index
+    stats['last_row'] = values[-1:].copy()
+    stats['digest'] = _rows_digest(values[:-1])
+    return True
+
+
+def covariance_from_stats(stats: dict) -> tuple:
+    """
+    Pairwise covariance and correlation matrices (ddof=1) from sufficient statistics,
+    matching DataFrame.cov() and DataFrame.corr() on the same panel.
+
+    Returns:
+        (cov, corr) as (tickers x tickers) DataFrames
+    """
+    n, sx, sxx, sxy = stats['n'], stats['sx'], stats['sxx'], stats['sxy']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Means over the rows a pair has in common differ per pair, hence sx and sx.T
+        cov = (sxy - sx * sx.T / n) / (n - 1)
+        var = (sxx - sx * sx / n) / (n - 1)  # var[i, j]: variance of i over the rows shared with j
+        corr = cov / np.sqrt(var * var.T)
+    cov[n < 2] = np.nan
+    np.clip(corr, -1.0, 1.0, out=corr)
+    diagonal = np.diag(var)
+    np.fill_diagonal(corr, np.where(diagonal > 0, 1.0, np.nan))
+
+    tickers = stats['tickers']
+    for matrix in (cov, corr):
+        matrix.flags.writeable = False
+    return (pd.DataFrame(cov, index=tickers, columns=tickers, copy=False),
+            pd.DataFrame(corr, index=tickers, columns=tickers, copy=False))
+
+
+def _find_extendable_stats(key: Hashable, logret: pd.DataFrame):
+    """
+    Most recent cached covariance statistics whose tickers and dates the given
+    panel extends, removed from their entry, with that entry's fingerprint.
+    """
+    with _lock:
+        for fp in reversed(_store):
+            stats = _store[fp].get(key)
+            if stats is None:
+                continue
+            dates = stats['dates']
+            if (stats['tickers'].equals(logret.columns) and 0 < len(dates) <= len(logret)
+                    and logret.index[len(dates) - 1] == dates[-1] and logret.index[0] == dates[0]):
+                return fp, _store[fp].pop(key)
+    return None
+
+
+def _restore_stats(fp: str, key: Hashable, stats: dict):
+    """Put statistics taken by _find_extendable_stats back, if their entry is still cached."""
+    with _lock:
+        if fp in _store:
+            _store[fp].setdefault(key, stats)
+
+
+def get_covariance(tall: pd.DataFrame, tickers=None, dtype=np.float64) -> tuple:
+    """
+    Pairwise covariance and correlation of log returns, sliced to tickers.
+
+    The full-universe matrices are computed once per tall dataframe; any
+    subset (sector filter, ...) is a slice of them. When a new tall only
+    adds rows to one already cached (earlier rows unchanged), the
+    statistics are updated rather than recomputed.
+
+    Args:
+        tall: The tall dataframe
+        tickers: Tickers to keep, in order (default: every ticker)
+        dtype: np.float32 or np.float64 for the matrix products
+
+    Returns:
+        (cov, corr) DataFrames, read-only
+    """
+    dtype = np.dtype(dtype).type
+    stats_key = ('covariance_stats', dtype)
+
+    def build_stats():
+        logret = get_panel(tall, 'logret')
+        found = _find_extendable_stats(stats_key, logret)
+        if found is not None:
+            fp, stats = found
+            if update_covariance_stats(stats, logret):
+                return stats
+            # Earlier rows changed: the cached statistics stay with their own tall
+            _restore_stats(fp, stats_key, stats)
+        return covariance_stats(logret, dtype)
+
+    def build_matrices():
+        return covariance_from_stats(memoize(tall, stats_key, build_stats))
+
+    cov, corr = memoize(tall, ('covariance', dtype), build_matrices)
+    if tickers is None:
+        return cov, corr
+
+    positions = cov.index.get_indexer(list(tickers))
+    if (positions < 0).any():
+        raise KeyError(f"Tickers not in the panel: {list(pd.Index(tickers)[positions < 0])}")
+    take = np.ix_(positions, positions)
+    labels = cov.index[positions]
+    return (pd.DataFrame(cov.to_numpy()[take], index=labels, columns=labels),
+            pd.DataFrame(corr.to_numpy()[take], index=labels, columns=labels))
+
+
+def get_correlation(tall: pd.DataFrame, tickers=None, dtype=np.float64) -> pd.DataFrame:
+    """Pairwise correlation of log returns, sliced to tickers (see get_covariance)."""
+    return get_covariance(tall, tickers, dtype)[1]
+
+
+def linkage_from_correlation(corr: np.ndarray, method: str = 'average') -> np.ndarray:
+    """Linkage matrix of the correlation distance 1 - corr."""
+    corr_condensed = scipy.cluster.hierarchy.distance.squareform(1 - np.asarray(corr), checks=False)
+    return scipy.cluster.hierarchy.linkage(corr_condensed, method=method)
+
+
+def get_linkage(tall: pd.DataFrame, tickers=None, method: str = 'average', dtype=np.float64) -> np.ndarray:
+    """
+    Hierarchical clustering tree of the tickers on correlation distance, built
+    once per tall dataframe, ticker selection and linkage method.
+
+    Args:
+        tall: The tall dataframe
+        tickers: Tickers to cluster, in order (default: every ticker)
+        method: scipy linkage method ('average', 'single', ...)
+        dtype: Precision of the correlation matrix (see get_covariance)
+
+    Returns:
+        scipy linkage matrix, read-only
+    """
+    corr = get_correlation(tall, tickers, dtype)
+    key = ('linkage', tuple(corr.columns), method, np.dtype(dtype).name)
+
+    def build():
+        z = linkage_from_correlation(corr.to_numpy(), method)
+        z.flags.writeable = False
+        return z
+
+    return memoize(tall, key, build)
+
+
+def rolling_covariance(values: np.ndarray, window: int, step: int = 1):
+    """
+    Covariance of the columns of values over a rolling window of rows.
+
+    The sums of the window are kept up to date by adding the rows that enter
+    and subtracting the rows that leave, so each step costs O(step x N^2)
+    instead of O(window x N^2). When a step replaces more than half of the
+    window the window's sums are recomputed instead, which is cheaper.
+    Missing values count as zero.
+
+    Args:
+        values: (dates x tickers) array
+        window: Rows in each window
+        step: Rows between consecutive windows
+
+    Yields:
+        (end, cov): end is the index of the last row of the window, cov the
+        (tickers x tickers) covariance (ddof=1) of rows end - window + 1 to end
+    """
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64), nan=0.0, posinf=0.0, neginf=0.0)
+    # Shift by the overall mean to keep the running sums well conditioned
+    values = values - values.mean(axis=0)
+    first = values[:window]
+    sums, cross = first.sum(axis=0), first.T @ first
+    end = window - 1
+    while end < len(values):
+        cov = np.outer(sums, sums * (-1 / window))
+        cov += cross
+        cov /= window - 1
+        yield end, cov
+        if end + step >= len(values):
+            break
+        end += step
+        if 2 * step < window:
+            entering = values[end + 1 - step:end + 1]
+            leaving = values[end + 1 - window - step:end + 1 - window]
+            sums += entering.sum(axis=0) - leaving.sum(axis=0)
+            # One product for both updates: [entering; leaving]' [entering; -leaving]
+            cross += np.vstack([entering, leaving]).T @ np.vstack([entering, -leaving])
+        else:
+            rows = values[end + 1 - window:end + 1]
+            sums, cross = rows.sum(axis=0), rows.T @ rows
+
+
+def benchmark_correlation(sizes=(500, 3000), n_dates=2520, sector_size=300, pandas_max_tickers=1000, seed=0):
+    """
+    Time the full-universe correlation build (float64 and float32), a sector
+    slice and a one-row incremental update against DataFrame.corr().
+
+    Returns:
+        DataFrame with one row per universe size, timings in seconds
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for n_tickers in sizes:
+        values = rng.normal(0, 0.01, size=(n_dates + 1, n_tickers))
+        values[rng.random(values.shape) < 0.02] = np.nan
+        dates = pd.bdate_range('2015-01-01', periods=n_dates + 1, name='Date')
+        logret = pd.DataFrame(values, index=dates, columns=pd.Index([f"T{i:05d}" for i in range(n_tickers)], name='Ticker'))
+        row = {'Tickers': n_tickers, 'Dates': n_dates}
+
+        for dtype in (np.float64, np.float32):
+            start = time.perf_counter()
+            stats = covariance_stats(logret.iloc[:n_dates], dtype)
+            cov, corr = covariance_from_stats(stats)
+            row[f"Full build {dtype.__name__}"] = time.perf_counter() - start
+
+        positions = np.sort(rng.choice(n_tickers, size=min(sector_size, n_tickers), replace=False))
+        start = time.perf_counter()
+        corr.to_numpy()[np.ix_(positions, positions)]
+        row['Sector slice'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        update_covariance_stats(stats, logret)
+        covariance_from_stats(stats)
+        row['Add one row'] = time.perf_counter() - start
+
+        if n_tickers <= pandas_max_tickers:
+            start = time.perf_counter()
+            logret.iloc[:n_dates].corr()
+            row['pandas corr()'] = time.perf_counter() - start
+        rows.append(row)
+    return pd.DataFrame(rows)